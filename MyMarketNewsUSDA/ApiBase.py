@@ -1,12 +1,55 @@
-import datetime
-from typing import Any
+from __future__ import annotations
 
-import requests
-from requests.auth import HTTPBasicAuth
+import datetime
+import time
+from typing import TYPE_CHECKING, Any, Callable, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
 
 from MyMarketNewsUSDA.ApiKey import ApiKey
+from MyMarketNewsUSDA.Cache import canonical_url, request_key
+from MyMarketNewsUSDA.Instrumentation import Event, get_default_instrumentation
+from MyMarketNewsUSDA.RateLimit import (THROTTLE_STATUSES, RateLimiter, RetryPolicy, get_default_rate_limiter,
+                                        parse_retry_after)
+from MyMarketNewsUSDA.SingleFlight import get_default_single_flight
+from MyMarketNewsUSDA.Sharding import DEFAULT_WORKERS, map_ordered, merge_rows, row_fingerprint, split_date_range
+from MyMarketNewsUSDA.Streaming import DEFAULT_BATCH_SIZE, DEFAULT_CHUNK_SIZE, iter_batches, iter_json_array
 from constants import REPORT_API_BASE_URL, MARKET_API_BASE_URL
 
+# pandas, requests and the decoders are imported where they are first used, so that importing the package stays cheap
+if TYPE_CHECKING:
+    import pandas as pd
+    import requests
+
+    from MyMarketNewsUSDA.Cache import ResponseCache
+    from MyMarketNewsUSDA.Decoding import ReportSchema
+    from MyMarketNewsUSDA.Transport import Transport
+
+
+def response_validators(_response: requests.Response) -> dict:
+    """
+    :param _response: A response
+    :return: the validators of the response usable in a conditional request, "etag" and/or "last_modified"
+    """
+    validators = {}
+    if _response.headers.get("ETag"):
+        validators["etag"] = _response.headers["ETag"]
+    if _response.headers.get("Last-Modified"):
+        validators["last_modified"] = _response.headers["Last-Modified"]
+    return validators
+
+
+def conditional_headers(validators: dict) -> dict:
+    """
+    :param validators: The "etag" and "last_modified" returned with the data held by the caller, if any
+    :return: the If-None-Match / If-Modified-Since headers of a conditional request for that data
+    """
+    headers = {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    return headers
+
 
 def capitalize_first_letters(s):
     return ' '.join(word.capitalize() for word in s.split())
@@ -36,10 +79,50 @@ def convert_api_commodity(commodity: str) -> str:
 class ApiBase(ApiKey):
     """
     Base class for all API methods
+
+    :param api_key: The MyMarketNews API key
+    :param api_type: Either "report" or "market"
+    :param transport: The Transport to send requests through, defaults to the shared process wide transport
+    :param cache: An optional ResponseCache consulted before every request
+    :param rate_limiter: The per host RateLimiter requests wait on, defaults to the shared process wide limiter
+    :param retry_policy: The RetryPolicy of throttled, failed or unreachable requests
+
+    Identical concurrent requests are coalesced through the shared SingleFlight in the single_flight attribute, and
+    every call is reported to the shared Instrumentation in the instrumentation attribute (None disables both).
+    The report_base_url and market_base_url attributes can be overridden, on the class or an instance, to send the
+    requests to another server, e.g. a local stand-in
     """
-    def __init__(self, api_key: str = None, api_type: str = "report"):
+    report_base_url = REPORT_API_BASE_URL
+    market_base_url = MARKET_API_BASE_URL
+
+    def __init__(self, api_key: str = None, api_type: str = "report", transport: Transport = None,
+                 cache: ResponseCache = None, rate_limiter: RateLimiter = None, retry_policy: RetryPolicy = None):
         super().__init__(api_key, api_type)
         self.api_type = api_type
+        self._transport = transport
+        self.cache = cache
+        self.rate_limiter = get_default_rate_limiter() if rate_limiter is None else rate_limiter
+        self.retry_policy = RetryPolicy() if retry_policy is None else retry_policy
+        self.single_flight = get_default_single_flight()
+        self.instrumentation = get_default_instrumentation()
+
+    @property
+    def transport(self) -> Transport:
+        """
+        The transport used for every request made by this instance
+        """
+        if self._transport is None:
+            from MyMarketNewsUSDA.Transport import get_default_transport
+            return get_default_transport()
+        return self._transport
+
+    def set_transport(self, transport: Transport) -> None:
+        """
+        Sets the transport of the ApiBase class
+        :param transport: The transport to be set, or None to use the shared default transport
+        :return: None
+        """
+        self._transport = transport
 
     def create_api_url(self, **kwargs) -> str:
         """
@@ -63,7 +146,7 @@ class ApiBase(ApiKey):
         :return: The URL for the API call
         """
         if self.api_type == "report":
-            _url = REPORT_API_BASE_URL + kwargs.get('slug_id', '')
+            _url = self.report_base_url + kwargs.get('slug_id', '')
             if kwargs.get('begin_date') is not None:
                 begin_date = kwargs.get('begin_date')
                 if isinstance(begin_date, datetime.date):
@@ -78,7 +161,7 @@ class ApiBase(ApiKey):
                 _url += f"&key={kwargs.get('key')}"
         elif self.api_type == "market":
             # since this is a post, the variables are passed through the POST payload
-            _url = MARKET_API_BASE_URL
+            _url = self.market_base_url
         else:
             raise NotImplementedError(f"api_type must be either 'report' or 'market', not {self.api_type}. "
                                       f"This type is not yet implemented")
@@ -104,7 +187,7 @@ class ApiBase(ApiKey):
         Creates the payload for the Market API call
         :param kwargs: The keyword arguments for the Market API call
             can be any of the following:
-                - commodity
+                - commodity, or a list of commodities requested together
                 - region
                 - class_
                 - organic
@@ -113,7 +196,9 @@ class ApiBase(ApiKey):
         :return: The payload for the Market API call
         """
         payload = {}
-        if kwargs.get('commodity') is not None:
+        if isinstance(kwargs.get('commodity'), (list, tuple)):
+            payload['COMD'] = [convert_api_commodity(x) for x in kwargs.get('commodity')]
+        elif kwargs.get('commodity') is not None:
             payload['COMD'] = convert_api_commodity(kwargs.get('commodity'))
         if kwargs.get('region') is not None:
             payload['REGN'] = convert_api_region(kwargs.get('region'))
@@ -135,24 +220,406 @@ class ApiBase(ApiKey):
             payload["MT"] = "/3/"
         return payload
 
-    def get_data(self, _url: str, payload: dict = None) -> Any:
+    def request_args(self, payload: dict = None) -> Tuple[str, dict]:
         """
-        Gets the data from the API call
-        :param _url:
+        Builds the HTTP method and request arguments for the API call, shared by the sync and async clients
         :param payload: The payload for the Market API call
-        :return:
+        :return: The HTTP method and a dict that may contain 'auth' as a (user, password) tuple and/or 'json'
         """
         if self.api_type == "report":
-            _response = requests.get(_url, auth=HTTPBasicAuth(self.api_key, ''))
+            return "GET", {"auth": (self.api_key, '')}
         elif self.api_type == "market":
             if payload is None:
                 payload = {}
-            _response = requests.post(_url, json=payload)
-            print(_url, payload)
+            return "POST", {"json": payload}
         else:
             raise NotImplementedError(f"api_type must be either 'report' or 'market', not {self.api_type}. "
                                       f"This type is not yet implemented")
+
+    @staticmethod
+    def extract_results(body: dict) -> list:
+        """
+        Extracts the result rows from a decoded API response body
+        :param body: The decoded JSON body
+        :return: The list of result rows
+        """
+        return body.get('results', [])
+
+    def event_label(self, _url: str, payload: dict = None) -> str:
+        """
+        :param _url: The URL of an API call
+        :param payload: The payload of a Market API call
+        :return: the label instrumentation events of the call are aggregated under: the slug_id of a report, "catalog"
+            for the report listing, or the upper cased commodity of a market query
+        """
+        if self.api_type == "market":
+            commodity = (payload or {}).get("COMD", "market")
+            return (",".join(commodity) if isinstance(commodity, list) else str(commodity)).upper()
+        if _url.startswith(self.report_base_url):
+            slug_id = _url[len(self.report_base_url):]
+        else:
+            slug_id = urlsplit(_url).path.rstrip("/").rsplit("/", 1)[-1]
+        return slug_id.split("?", 1)[0] or "catalog"
+
+    def request_event(self, _url: str, payload: dict = None) -> Optional[Event]:
+        """
+        :return: a new "request" Event of the API call, None if instrumentation is disabled
+        """
+        if self.instrumentation is None:
+            return None
+        return Event("request", self.api_type, self.event_label(_url, payload), canonical_url(_url), payload,
+                     "GET" if self.api_type == "report" else "POST")
+
+    def emit_event(self, event: Optional[Event], start: float, data: Any = None) -> None:
+        """
+        Completes a "request" Event with the total time and number of rows and emits it
+        :param event: The Event, nothing is emitted if None
+        :param start: The time.perf_counter() value the call started at
+        :param data: The result rows of the call
+        """
+        if event is None:
+            return
+        event.total_time = time.perf_counter() - start
+        if isinstance(data, list):
+            event.rows = len(data)
+        self.instrumentation.emit(event)
+
+    def build_frame(self, build: Callable[[], pd.DataFrame], label: str) -> pd.DataFrame:
+        """
+        Builds a dataframe from API data, reporting the time taken as a "frame" Event
+        :param build: Builds the dataframe
+        :param label: The label of the Event, see event_label
+        :return: The dataframe
+        """
+        if self.instrumentation is None:
+            return build()
+        start = time.perf_counter()
+        frame = build()
+        self.instrumentation.emit(Event("frame", self.api_type, label, frame_time=time.perf_counter() - start,
+                                        rows=len(frame)))
+        return frame
+
+    def flight_key(self, key: str) -> tuple:
+        """
+        :param key: The request key of a call, see Cache.request_key
+        :return: the key identifying identical calls to the single flight, calls only share a result when they are
+            sent through the same transport with the same API key
+        """
+        return self.api_type, self.transport, self.api_key, key
+
+    def get_data(self, _url: str, payload: dict = None) -> Any:
+        """
+        Gets the data from the API call, from the cache if one is set and holds a fresh result. Identical calls made
+        concurrently from other threads share a single request, unless single_flight is set to None
+        :param _url:
+        :param payload: The payload for the Market API call
+        :return:
+        """
+        key = request_key(_url, payload)
+        event = self.request_event(_url, payload)
+        start = time.perf_counter()
+        data = None
+        try:
+            if self.cache is not None:
+                data = self.cache.get(key)
+                if event is not None:
+                    event.cache = "miss" if data is None else "hit"
+                if data is not None:
+                    return data
+
+            def fetch():
+                if event is not None:
+                    event.coalesced = False
+                _data = self.fetch_data(_url, payload, event)
+                if self.cache is not None and _data is not None:
+                    self.cache.set(key, _data, self.cache.ttl_for(_url, payload), canonical_url(_url))
+                return _data
+
+            if self.single_flight is None:
+                data = fetch()
+            else:
+                if event is not None:
+                    event.coalesced = True
+                data = self.single_flight.do(self.flight_key(key), fetch)
+            return data
+        except Exception as e:
+            if event is not None:
+                event.error = repr(e)
+            raise
+        finally:
+            self.emit_event(event, start, data)
+
+    def get_frame(self, _url: str, payload: dict = None, schema: ReportSchema = None, stream: bool = False,
+                  batch_size: int = DEFAULT_BATCH_SIZE) -> pd.DataFrame:
+        """
+        Gets the data from the API call as a typed dataframe, see get_data
+        :param _url:
+        :param payload: The payload for the Market API call
+        :param schema: The ReportSchema used to parse the columns, by default only report_date and published_date
+            are parsed
+        :param stream: If True the response is streamed into column buffers batch by batch (see iter_data and
+            FrameBuffer), peak memory stays close to the size of the frame. Streamed results are not cached
+        :param batch_size: The number of rows decoded before they are moved into the column buffers when streaming
+        :return: The data as a dataframe
+        """
+        from MyMarketNewsUSDA.Decoding import CATALOG_SCHEMA, FrameBuffer
+        schema = CATALOG_SCHEMA if schema is None else schema
+        if stream:
+            return self.build_frame(
+                lambda: FrameBuffer(schema).extend(self.iter_data(_url, payload, batch_size=batch_size)).frame(),
+                self.event_label(_url, payload))
+        data = self.get_data(_url, payload) or []
+        return self.build_frame(lambda: schema.frame(data), self.event_label(_url, payload))
+
+    def send(self, _url: str, payload: dict = None, stream: bool = False, event: Event = None,
+             headers: dict = None) -> requests.Response:
+        """
+        Sends the API call, waiting on the rate limiter of the host before every attempt and retrying throttled,
+        failed (5xx) or unreachable requests with jittered exponential backoff, honoring Retry-After
+        :param _url:
+        :param payload: The payload for the Market API call
+        :param stream: If True the response body is not read yet
+        :param headers: Extra request headers, e.g. the validators of a conditional request
+        :param event: An instrumentation Event that is given the attempts, status and time to first byte
+        :return: The response of the last attempt
+        """
+        import requests
+        from requests.auth import HTTPBasicAuth
+
+        method, request_kwargs = self.request_args(payload)
+        bucket = self.rate_limiter.bucket(_url)
+        attempt = 0
+        while True:
+            bucket.acquire()
+            if event is not None:
+                event.attempts = attempt + 1
+            try:
+                if method == "GET":
+                    _response = self.transport.get(_url, auth=HTTPBasicAuth(*request_kwargs["auth"]), stream=stream,
+                                                   headers=headers)
+                else:
+                    _response = self.transport.post(_url, json=request_kwargs["json"], stream=stream, headers=headers)
+            except (requests.ConnectionError, requests.Timeout):
+                if not self.retry_policy.should_retry(attempt):
+                    raise
+                time.sleep(self.retry_policy.backoff(attempt))
+                attempt += 1
+                continue
+            if event is not None:
+                event.status_code = _response.status_code
+                # requests measures until the response headers are parsed, DNS and connect included
+                event.ttfb = _response.elapsed.total_seconds()
+            retry_after = parse_retry_after(_response.headers.get("Retry-After"))
+            # a throttled response backs the limiter off even when it is not retried
+            if _response.status_code in THROTTLE_STATUSES:
+                bucket.on_throttle(retry_after)
+            elif _response.status_code < 400:
+                bucket.on_success()
+            if not self.retry_policy.should_retry(attempt, _response.status_code):
+                return _response
+            _response.close()
+            time.sleep(self.retry_policy.backoff(attempt, retry_after))
+            attempt += 1
+
+    def fetch_data(self, _url: str, payload: dict = None, event: Event = None) -> Any:
+        """
+        Gets the data from the API call over the network
+        :param _url:
+        :param payload: The payload for the Market API call
+        :param event: An instrumentation Event that is given the response size and decode time
+        :return:
+        """
+        _response = self.send(_url, payload, event=event)
         if _response.status_code == 200:
-            return _response.json().get('results', [])
+            return self.decode(_response, event)
         else:
             _response.raise_for_status()
+
+    def decode(self, _response: requests.Response, event: Event = None) -> Any:
+        """
+        Decodes the result rows of a successful response
+        :param _response: The response
+        :param event: An instrumentation Event that is given the response size and decode time
+        :return: The result rows
+        """
+        return self.decode_content(_response.content, event)
+
+    def decode_content(self, content: bytes, event: Event = None) -> Any:
+        """
+        Decodes the result rows of the body of a successful response
+        :param content: The body
+        :param event: An instrumentation Event that is given the response size and decode time
+        :return: The result rows
+        """
+        from MyMarketNewsUSDA.Decoding import loads
+        start = time.perf_counter()
+        data = self.extract_results(loads(content))
+        if event is not None:
+            event.response_bytes = len(content)
+            event.decode_time = time.perf_counter() - start
+        return data
+
+    def get_conditional(self, _url: str, validators: dict = None) -> Tuple[Any, dict]:
+        """
+        Gets the data from a report API call unless it did not change since the validators were returned, by sending
+        them as If-None-Match / If-Modified-Since. The cache and single flight of get_data are not used
+        :param _url:
+        :param validators: The "etag" and "last_modified" returned with the data held by the caller, if any
+        :return: (None, validators) if the server answered 304 Not Modified, otherwise (the result rows, the
+            validators of the response, empty if the server sent none)
+        """
+        validators = validators or {}
+        headers = conditional_headers(validators)
+        event = self.request_event(_url)
+        start = time.perf_counter()
+        data = None
+        try:
+            _response = self.send(_url, event=event, headers=headers or None)
+            if _response.status_code == 304:
+                if event is not None:
+                    event.cache = "not_modified"
+                return None, {**validators, **response_validators(_response)}
+            if _response.status_code != 200:
+                _response.raise_for_status()
+                return data, {}
+            data = self.decode(_response, event)
+            return data, response_validators(_response)
+        except Exception as e:
+            if event is not None:
+                event.error = repr(e)
+            raise
+        finally:
+            self.emit_event(event, start, data)
+
+    def iter_data(self, _url: str, payload: dict = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                  chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[List[dict]]:
+        """
+        Streams the data from the API call in batches, the response body is decoded incrementally so memory use is
+        bounded by the batch size rather than by the size of the response. A fresh cached result is served instead
+        if a cache is set, streamed results are not written to the cache. The "request" Event of the call is emitted
+        once the stream ends, its total_time includes the time spent by the consumer between batches
+        :param _url:
+        :param payload: The payload for the Market API call
+        :param batch_size: The maximum number of rows per batch
+        :param chunk_size: The number of bytes read from the network at a time
+        :return: An iterator over lists of result rows
+        """
+        event = self.request_event(_url, payload)
+        start = time.perf_counter()
+        rows = 0
+        try:
+            if self.cache is not None:
+                data = self.cache.get(request_key(_url, payload))
+                if event is not None:
+                    event.cache = "miss" if data is None else "hit"
+                if data is not None:
+                    for batch in iter_batches(data, batch_size):
+                        rows += len(batch)
+                        yield batch
+                    return
+            _response = self.send(_url, payload, stream=True, event=event)
+            try:
+                if _response.status_code != 200:
+                    _response.raise_for_status()
+                    return
+
+                def chunks():
+                    for chunk in _response.iter_content(chunk_size):
+                        if event is not None:
+                            event.response_bytes = (event.response_bytes or 0) + len(chunk)
+                        yield chunk
+
+                for batch in iter_batches(iter_json_array(chunks()), batch_size):
+                    rows += len(batch)
+                    yield batch
+            finally:
+                _response.close()
+        except Exception as e:
+            if event is not None:
+                event.error = repr(e)
+            raise
+        finally:
+            if event is not None:
+                event.rows = rows
+            self.emit_event(event, start)
+
+    def iter_report_data(self, slug_id: str, begin_date=None, end_date=None, window_days: int = None,
+                         batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[List[dict]]:
+        """
+        Streams the data of a report in batches, see get_report_data. Windows are streamed one after another, only
+        the row fingerprints of the previous window are kept to drop the duplicates at window edges
+        :param slug_id: The slug_id of the report
+        :param begin_date: The first report date to fetch, as MM/DD/YYYY or a date
+        :param end_date: The last report date to fetch, defaults to today when begin_date is given
+        :param window_days: The number of days fetched per request, if None the whole range is a single request
+        :param batch_size: The maximum number of rows per batch
+        :return: An iterator over lists of result rows
+        """
+        if self.api_type != "report":
+            raise NotImplementedError(f"iter_report_data is only available for api_type 'report', not {self.api_type}")
+        if begin_date is None or window_days is None:
+            yield from self.iter_data(self.create_api_url(slug_id=slug_id, begin_date=begin_date, end_date=end_date),
+                                      batch_size=batch_size)
+            return
+        if end_date is None:
+            end_date = datetime.date.today()
+        previous_keys = set()
+        for window_begin, window_end in split_date_range(begin_date, end_date, window_days):
+            keys = set()
+            _url = self.create_api_url(slug_id=slug_id, begin_date=window_begin, end_date=window_end)
+            for batch in self.iter_data(_url, batch_size=batch_size):
+                rows = []
+                for row in batch:
+                    key = row_fingerprint(row)
+                    keys.add(key)
+                    if key not in previous_keys:
+                        rows.append(row)
+                if rows:
+                    yield rows
+            previous_keys = keys
+
+    def get_report_frame(self, slug_id: str, begin_date=None, end_date=None, window_days: int = None,
+                         workers: int = DEFAULT_WORKERS, schema: ReportSchema = None, stream: bool = False,
+                         batch_size: int = DEFAULT_BATCH_SIZE) -> pd.DataFrame:
+        """
+        Gets the data of a report as a typed dataframe, see get_report_data
+        :param schema: The ReportSchema used to parse the columns, defaults to the schema registered for the slug_id
+        :param stream: If True the report is streamed into column buffers batch by batch (see iter_report_data and
+            FrameBuffer), so that peak memory stays close to the size of the frame. Windows are then streamed one
+            after another instead of concurrently
+        :param batch_size: The number of rows decoded before they are moved into the column buffers when streaming
+        :return: The report data as a dataframe
+        """
+        from MyMarketNewsUSDA.Decoding import FrameBuffer, get_schema
+        schema = get_schema(slug_id) if schema is None else schema
+        if stream:
+            batches = self.iter_report_data(slug_id, begin_date=begin_date, end_date=end_date,
+                                            window_days=window_days, batch_size=batch_size)
+            return self.build_frame(lambda: FrameBuffer(schema).extend(batches).frame(), str(slug_id))
+        data = self.get_report_data(slug_id, begin_date=begin_date, end_date=end_date, window_days=window_days,
+                                    workers=workers) or []
+        return self.build_frame(lambda: schema.frame(data), str(slug_id))
+
+    def get_report_data(self, slug_id: str, begin_date=None, end_date=None, window_days: int = None,
+                        workers: int = DEFAULT_WORKERS) -> Any:
+        """
+        Gets the data of a report, optionally splitting a long date range into windows that are fetched concurrently
+        :param slug_id: The slug_id of the report
+        :param begin_date: The first report date to fetch, as MM/DD/YYYY or a date
+        :param end_date: The last report date to fetch, defaults to today when begin_date is given
+        :param window_days: The number of days fetched per request, if None the whole range is a single request
+        :param workers: The maximum number of windows fetched concurrently
+        :return: The result rows of every window merged in date order, without the duplicates at window edges
+        """
+        if self.api_type != "report":
+            raise NotImplementedError(f"get_report_data is only available for api_type 'report', not {self.api_type}")
+        if begin_date is None or window_days is None:
+            return self.get_data(self.create_api_url(slug_id=slug_id, begin_date=begin_date, end_date=end_date))
+        if end_date is None:
+            end_date = datetime.date.today()
+        windows = split_date_range(begin_date, end_date, window_days)
+        chunks = map_ordered(
+            lambda window_begin, window_end: self.get_data(
+                self.create_api_url(slug_id=slug_id, begin_date=window_begin, end_date=window_end)),
+            windows, workers)
+        return merge_rows(chunks)
@@ -0,0 +1,765 @@
+"""
+Author: Jacob Dallas
+
+asyncio counterparts of Report, Market and MyMarketNews. URL and payload building as well as result handling are
+inherited from the sync classes, only the I/O is replaced, so both clients return identical data.
+
+Requires aiohttp (`pip install aiohttp`).
+"""
+import asyncio
+import contextlib
+import datetime
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple, Union
+
+try:
+    import aiohttp
+except ImportError as e:
+    raise ImportError("The async MyMarketNews client requires aiohttp, install it with `pip install aiohttp`") from e
+
+import pandas as pd
+
+from MyMarketNewsUSDA.ApiBase import ApiBase, conditional_headers, response_validators
+from MyMarketNewsUSDA.Cache import canonical_url, request_key
+from MyMarketNewsUSDA.Catalog import ReportIndex
+from MyMarketNewsUSDA.Decoding import CATALOG_SCHEMA, FrameBuffer, ReportSchema, get_schema, loads
+from MyMarketNewsUSDA.Instrumentation import Event
+from MyMarketNewsUSDA.Market import Market
+from MyMarketNewsUSDA.MyMarketNews import MyMarketNews
+from MyMarketNewsUSDA.RateLimit import THROTTLE_STATUSES, parse_retry_after
+from MyMarketNewsUSDA.Sharding import DEFAULT_WORKERS, merge_rows, row_fingerprint, split_date_range, to_date
+from MyMarketNewsUSDA.SingleFlight import AsyncSingleFlight, get_default_async_single_flight
+from MyMarketNewsUSDA.Store import ReportStore
+from MyMarketNewsUSDA.Streaming import DEFAULT_BATCH_SIZE, DEFAULT_CHUNK_SIZE, iter_batches, iter_json_array
+from MyMarketNewsUSDA.Transport import DEFAULT_CONNECT_TIMEOUT, DEFAULT_POOL_MAXSIZE, DEFAULT_READ_TIMEOUT
+
+DEFAULT_MAX_CONCURRENCY = 8
+
+
+class AsyncTransport:
+    """
+    Pooled aiohttp transport with a semaphore capping the number of requests in flight
+
+    The aiohttp session and the semaphore are bound to the running event loop, they are created on first use and
+    recreated if the transport is later used from a different loop (e.g. across separate asyncio.run calls).
+
+    :param max_concurrency: The maximum number of requests in flight at once
+    :param pool_maxsize: The maximum number of connections kept alive per host
+    :param timeout: Either a single timeout in seconds or a (connect, read) tuple
+    """
+    def __init__(self, max_concurrency: int = DEFAULT_MAX_CONCURRENCY, pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+                 timeout=(DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT)):
+        if max_concurrency < 1:
+            raise ValueError(f"max_concurrency must be at least 1, not {max_concurrency}")
+        self.max_concurrency = max_concurrency
+        self.pool_maxsize = pool_maxsize
+        self.timeout = timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _client_timeout(self) -> aiohttp.ClientTimeout:
+        if isinstance(self.timeout, tuple):
+            return aiohttp.ClientTimeout(connect=self.timeout[0], sock_read=self.timeout[1])
+        return aiohttp.ClientTimeout(total=self.timeout)
+
+    def _bind(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit_per_host=self.pool_maxsize),
+                timeout=self._client_timeout())
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+        return self._session
+
+    @contextlib.asynccontextmanager
+    async def open(self, method: str, _url: str, auth: tuple = None, json: dict = None,
+                   headers: dict = None) -> AsyncIterator[aiohttp.ClientResponse]:
+        """
+        Sends a request and yields the response once its headers are received, the body is read by the caller. The
+        request holds a slot of the semaphore until the response is released
+        :param method: Either "GET" or "POST"
+        :param _url: The URL to request
+        :param auth: An optional (user, password) tuple for basic auth
+        :param json: An optional JSON payload
+        :param headers: Extra request headers
+        :return: The response
+        """
+        session = self._bind()
+        async with self._semaphore:
+            async with session.request(method, _url, json=json, headers=headers,
+                                       auth=aiohttp.BasicAuth(*auth) if auth is not None else None) as _response:
+                yield _response
+
+    async def request_json(self, method: str, _url: str, auth: tuple = None, json: dict = None) -> Any:
+        """
+        Sends a request and decodes the JSON body
+        :param method: Either "GET" or "POST"
+        :param _url: The URL to request
+        :param auth: An optional (user, password) tuple for basic auth
+        :param json: An optional JSON payload
+        :return: The decoded body, or None if the response was not a 200 but not an error either
+        """
+        async with self.open(method, _url, auth=auth, json=json) as _response:
+            if _response.status == 200:
+                return loads(await _response.read())
+            _response.raise_for_status()
+            return None
+
+    async def close(self) -> None:
+        """
+        Closes the underlying aiohttp session
+        """
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def __repr__(self):
+        return f"AsyncTransport(max_concurrency={self.max_concurrency}, pool_maxsize={self.pool_maxsize})"
+
+
+_default_async_transport: Optional[AsyncTransport] = None
+_default_async_transport_lock = threading.Lock()
+
+
+def get_default_async_transport() -> AsyncTransport:
+    """
+    Returns the process wide transport used by every async instance that was not given its own
+    :return: The shared AsyncTransport
+    """
+    global _default_async_transport
+    if _default_async_transport is None:
+        with _default_async_transport_lock:
+            if _default_async_transport is None:
+                _default_async_transport = AsyncTransport()
+    return _default_async_transport
+
+
+class AsyncApiBase(ApiBase):
+    """
+    Replaces the blocking I/O of ApiBase with coroutines, everything else is inherited
+    """
+    async_single_flight: Optional[AsyncSingleFlight] = get_default_async_single_flight()
+
+    @property
+    def transport(self) -> AsyncTransport:
+        """
+        The async transport used for every request made by this instance
+        """
+        if self._transport is None:
+            return get_default_async_transport()
+        return self._transport
+
+    async def get_data(self, _url: str, payload: dict = None) -> Any:
+        """
+        Gets the data from the API call, from the cache if one is set and holds a fresh result. Identical calls made
+        concurrently on the event loop share a single request, unless async_single_flight is set to None
+        :param _url: The URL of the API call
+        :param payload: The payload for the Market API call
+        :return: The result rows of the API call
+        """
+        key = request_key(_url, payload)
+        event = self.request_event(_url, payload)
+        start = time.perf_counter()
+        data = None
+        try:
+            if self.cache is not None:
+                data = self.cache.get(key)
+                if event is not None:
+                    event.cache = "miss" if data is None else "hit"
+                if data is not None:
+                    return data
+
+            async def fetch():
+                if event is not None:
+                    event.coalesced = False
+                _data = await self.fetch_data(_url, payload, event)
+                if self.cache is not None and _data is not None:
+                    self.cache.set(key, _data, self.cache.ttl_for(_url, payload), canonical_url(_url))
+                return _data
+
+            if self.async_single_flight is None:
+                data = await fetch()
+            else:
+                if event is not None:
+                    event.coalesced = True
+                data = await self.async_single_flight.do(self.flight_key(key), fetch)
+            return data
+        except Exception as e:
+            if event is not None:
+                event.error = repr(e)
+            raise
+        finally:
+            self.emit_event(event, start, data)
+
+    @contextlib.asynccontextmanager
+    async def send(self, _url: str, payload: dict = None, event: Event = None,
+                   headers: dict = None) -> AsyncIterator[aiohttp.ClientResponse]:
+        """
+        Sends the API call, rate limited and retried like ApiBase.send, and yields the response of the last attempt
+        with its body unread
+        :param _url: The URL of the API call
+        :param payload: The payload for the Market API call
+        :param event: An instrumentation Event that is given the attempts, status and time to first byte
+        :param headers: Extra request headers, e.g. the validators of a conditional request
+        :return: The response
+        """
+        method, request_kwargs = self.request_args(payload)
+        bucket = self.rate_limiter.bucket(_url)
+        attempt = 0
+        yielded = False
+        while True:
+            wait = bucket.reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            if event is not None:
+                event.attempts = attempt + 1
+            start = time.perf_counter()
+            try:
+                async with self.transport.open(method, _url, headers=headers, **request_kwargs) as _response:
+                    if event is not None:
+                        event.status_code = _response.status
+                        event.ttfb = time.perf_counter() - start
+                    retry_after = parse_retry_after(_response.headers.get("Retry-After"))
+                    if _response.status in THROTTLE_STATUSES:
+                        bucket.on_throttle(retry_after)
+                    elif _response.status < 400:
+                        bucket.on_success()
+                    if not self.retry_policy.should_retry(attempt, _response.status):
+                        yielded = True
+                        yield _response
+                        return
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                # once the response is handed out a failure while reading the body belongs to the caller
+                if yielded or not self.retry_policy.should_retry(attempt):
+                    raise
+                retry_after = None
+            await asyncio.sleep(self.retry_policy.backoff(attempt, retry_after))
+            attempt += 1
+
+    async def fetch_data(self, _url: str, payload: dict = None, event: Event = None) -> Any:
+        """
+        Gets the data from the API call over the network, see send
+        :param _url: The URL of the API call
+        :param payload: The payload for the Market API call
+        :param event: An instrumentation Event that is given the response size and decode time
+        :return: The result rows of the API call
+        """
+        async with self.send(_url, payload, event=event) as _response:
+            if _response.status == 200:
+                return self.decode_content(await _response.read(), event)
+            _response.raise_for_status()
+
+    async def get_conditional(self, _url: str, validators: dict = None) -> Tuple[Any, dict]:
+        """
+        Gets the data from a report API call unless it did not change since the validators were returned, see
+        ApiBase.get_conditional
+        :param _url: The URL of the API call
+        :param validators: The "etag" and "last_modified" returned with the data held by the caller, if any
+        :return: (None, validators) if the server answered 304 Not Modified, otherwise (the result rows, the
+            validators of the response)
+        """
+        validators = validators or {}
+        event = self.request_event(_url)
+        start = time.perf_counter()
+        data = None
+        try:
+            async with self.send(_url, event=event, headers=conditional_headers(validators) or None) as _response:
+                if _response.status == 304:
+                    if event is not None:
+                        event.cache = "not_modified"
+                    return None, {**validators, **response_validators(_response)}
+                if _response.status != 200:
+                    _response.raise_for_status()
+                    return data, {}
+                data = self.decode_content(await _response.read(), event)
+                return data, response_validators(_response)
+        except Exception as e:
+            if event is not None:
+                event.error = repr(e)
+            raise
+        finally:
+            self.emit_event(event, start, data)
+
+    async def iter_data(self, _url: str, payload: dict = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                        chunk_size: int = DEFAULT_CHUNK_SIZE) -> AsyncIterator[List[dict]]:
+        """
+        Streams the data from the API call in batches, see ApiBase.iter_data. The body is decoded incrementally in a
+        worker thread that pulls the chunks from the event loop, so the loop is never blocked by the decoding
+        :param _url: The URL of the API call
+        :param payload: The payload for the Market API call
+        :param batch_size: The maximum number of rows per batch
+        :param chunk_size: The number of bytes read from the network at a time
+        :return: An async iterator over lists of result rows
+        """
+        event = self.request_event(_url, payload)
+        start = time.perf_counter()
+        rows = 0
+        try:
+            if self.cache is not None:
+                data = self.cache.get(request_key(_url, payload))
+                if event is not None:
+                    event.cache = "miss" if data is None else "hit"
+                if data is not None:
+                    for batch in iter_batches(data, batch_size):
+                        rows += len(batch)
+                        yield batch
+                    return
+            async with self.send(_url, payload, event=event) as _response:
+                if _response.status != 200:
+                    _response.raise_for_status()
+                    return
+                loop = asyncio.get_running_loop()
+
+                def chunks():
+                    while True:
+                        chunk = asyncio.run_coroutine_threadsafe(_response.content.read(chunk_size), loop).result()
+                        if not chunk:
+                            return
+                        if event is not None:
+                            event.response_bytes = (event.response_bytes or 0) + len(chunk)
+                        yield chunk
+
+                batches = iter_batches(iter_json_array(chunks()), batch_size)
+                while True:
+                    batch = await asyncio.to_thread(next, batches, None)
+                    if batch is None:
+                        return
+                    rows += len(batch)
+                    yield batch
+        except Exception as e:
+            if event is not None:
+                event.error = repr(e)
+            raise
+        finally:
+            if event is not None:
+                event.rows = rows
+            self.emit_event(event, start)
+
+    async def iter_report_data(self, slug_id: str, begin_date=None, end_date=None, window_days: int = None,
+                               batch_size: int = DEFAULT_BATCH_SIZE) -> AsyncIterator[List[dict]]:
+        """
+        Streams the data of a report in batches, see ApiBase.iter_report_data
+        :return: An async iterator over lists of result rows
+        """
+        if self.api_type != "report":
+            raise NotImplementedError(f"iter_report_data is only available for api_type 'report', not {self.api_type}")
+        if begin_date is None or window_days is None:
+            async for batch in self.iter_data(self.create_api_url(slug_id=slug_id, begin_date=begin_date,
+                                                                  end_date=end_date), batch_size=batch_size):
+                yield batch
+            return
+        if end_date is None:
+            end_date = datetime.date.today()
+        previous_keys = set()
+        for window_begin, window_end in split_date_range(begin_date, end_date, window_days):
+            keys = set()
+            _url = self.create_api_url(slug_id=slug_id, begin_date=window_begin, end_date=window_end)
+            async for batch in self.iter_data(_url, batch_size=batch_size):
+                rows = []
+                for row in batch:
+                    key = row_fingerprint(row)
+                    keys.add(key)
+                    if key not in previous_keys:
+                        rows.append(row)
+                if rows:
+                    yield rows
+            previous_keys = keys
+
+    async def get_frame(self, _url: str, payload: dict = None, schema: ReportSchema = None, stream: bool = False,
+                        batch_size: int = DEFAULT_BATCH_SIZE) -> pd.DataFrame:
+        """
+        Gets the data from the API call as a typed dataframe, see ApiBase.get_frame
+        """
+        schema = CATALOG_SCHEMA if schema is None else schema
+        if stream:
+            buffer = FrameBuffer(schema)
+            async for batch in self.iter_data(_url, payload, batch_size=batch_size):
+                buffer.append(batch)
+            return self.build_frame(buffer.frame, self.event_label(_url, payload))
+        data = await self.get_data(_url, payload) or []
+        return self.build_frame(lambda: schema.frame(data), self.event_label(_url, payload))
+
+    async def get_report_data(self, slug_id: str, begin_date=None, end_date=None, window_days: int = None,
+                              workers: int = None) -> Any:
+        """
+        Gets the data of a report, see ApiBase.get_report_data. The windows are fetched concurrently, capped by the
+        transport semaphore rather than by workers
+        """
+        if self.api_type != "report":
+            raise NotImplementedError(f"get_report_data is only available for api_type 'report', not {self.api_type}")
+        if begin_date is None or window_days is None:
+            return await self.get_data(self.create_api_url(slug_id=slug_id, begin_date=begin_date, end_date=end_date))
+        if end_date is None:
+            end_date = datetime.date.today()
+        windows = split_date_range(begin_date, end_date, window_days)
+        chunks = await asyncio.gather(*[
+            self.get_data(self.create_api_url(slug_id=slug_id, begin_date=window_begin, end_date=window_end))
+            for window_begin, window_end in windows])
+        return merge_rows(chunks)
+
+    async def get_report_frame(self, slug_id: str, begin_date=None, end_date=None, window_days: int = None,
+                               workers: int = None, schema: ReportSchema = None, stream: bool = False,
+                               batch_size: int = DEFAULT_BATCH_SIZE) -> pd.DataFrame:
+        """
+        Gets the data of a report as a typed dataframe, see ApiBase.get_report_frame
+        """
+        schema = get_schema(slug_id) if schema is None else schema
+        if stream:
+            buffer = FrameBuffer(schema)
+            async for batch in self.iter_report_data(slug_id, begin_date=begin_date, end_date=end_date,
+                                                     window_days=window_days, batch_size=batch_size):
+                buffer.append(batch)
+            return self.build_frame(buffer.frame, str(slug_id))
+        data = await self.get_report_data(slug_id, begin_date=begin_date, end_date=end_date,
+                                          window_days=window_days) or []
+        return self.build_frame(lambda: schema.frame(data), str(slug_id))
+
+
+class AsyncReport(AsyncApiBase):
+    """
+    Async counterpart of Report, since neither a constructor nor an attribute access can be awaited the data is only
+    fetched once `load` is awaited
+    """
+    def __init__(self, **kwargs):
+        super().__init__(kwargs.get("api_key", None), transport=kwargs.get("transport", None),
+                         cache=kwargs.get("cache", None), rate_limiter=kwargs.get("rate_limiter", None),
+                         retry_policy=kwargs.get("retry_policy", None))
+        self.slug_id = kwargs.get("slug_id", None)
+        self.begin_date = kwargs.get("begin_date", None)
+        self.end_date = kwargs.get("end_date", None)
+        self.window_days = kwargs.get("window_days", None)
+        self.report_url = self.create_api_url(slug_id=self.slug_id)
+        self.loaded_at = None
+        self._data = None
+
+    @property
+    def data(self) -> list:
+        """
+        The report data, None until load is awaited
+        """
+        return self._data
+
+    @data.setter
+    def data(self, data: list) -> None:
+        self._data = data
+        self.loaded_at = time.monotonic()
+
+    @property
+    def is_loaded(self) -> bool:
+        """
+        Whether the report data has been gathered
+        """
+        return self.loaded_at is not None
+
+    async def to_frame(self, schema: ReportSchema = None, stream: bool = False,
+                       batch_size: int = DEFAULT_BATCH_SIZE) -> pd.DataFrame:
+        """
+        Returns the report data as a typed dataframe, loading it first if needed, see Report.to_frame
+        """
+        schema = get_schema(self.slug_id) if schema is None else schema
+        if stream and not self.is_loaded:
+            buffer = FrameBuffer(schema)
+            async for batch in self.iter_pages(batch_size):
+                buffer.append(batch)
+            return self.build_frame(buffer.frame, str(self.slug_id))
+        if not self.is_loaded:
+            await self.load()
+        data = self._data or []
+        return self.build_frame(lambda: schema.frame(data), str(self.slug_id))
+
+    async def fetch(self) -> list:
+        """
+        Gathers the data for the report over the configured date range, without storing it
+        :return: The report data
+        """
+        return await self.get_report_data(self.slug_id, begin_date=self.begin_date, end_date=self.end_date,
+                                          window_days=self.window_days)
+
+    async def load(self) -> list:
+        """
+        Gathers the data for the report and stores it in the data attribute
+        :return: The report data
+        """
+        self.data = await self.fetch()
+        return self._data
+
+    async def refresh(self, if_stale: Union[float, datetime.timedelta] = None) -> bool:
+        """
+        Gathers the data for the report again, see Report.refresh
+        :return: True if the data was gathered
+        """
+        if if_stale is not None and self.loaded_at is not None:
+            if isinstance(if_stale, datetime.timedelta):
+                if_stale = if_stale.total_seconds()
+            if time.monotonic() - self.loaded_at < if_stale:
+                return False
+        await self.load()
+        return True
+
+    def iter_pages(self, batch_size: int = DEFAULT_BATCH_SIZE) -> AsyncIterator[List[dict]]:
+        """
+        Streams the report over the configured date range in batches of rows without storing it in data
+        :param batch_size: The maximum number of rows per batch
+        :return: An async iterator over lists of result rows
+        """
+        return self.iter_report_data(self.slug_id, begin_date=self.begin_date, end_date=self.end_date,
+                                     window_days=self.window_days, batch_size=batch_size)
+
+    async def iter_rows(self, batch_size: int = DEFAULT_BATCH_SIZE) -> AsyncIterator[dict]:
+        """
+        Streams the report over the configured date range row by row without storing it in data
+        :param batch_size: The number of rows decoded ahead of the consumer
+        :return: An async iterator over the result rows
+        """
+        async for batch in self.iter_pages(batch_size):
+            for row in batch:
+                yield row
+
+    async def sync(self, store: ReportStore, batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+        """
+        Brings the stored copy of the report up to date, see Report.sync
+        :return: The number of appended rows
+        """
+        latest = store.latest_date(self.slug_id, "report_date")
+        begin_date = self.begin_date if latest is None else latest + datetime.timedelta(days=1)
+        end_date = self.end_date
+        if begin_date is not None:
+            if end_date is None:
+                end_date = datetime.date.today()
+            if to_date(begin_date) > to_date(end_date):
+                return 0
+        appended = 0
+        async for batch in self.iter_report_data(self.slug_id, begin_date=begin_date, end_date=end_date,
+                                                 window_days=self.window_days, batch_size=batch_size):
+            appended += store.append(self.slug_id, batch)
+        return appended
+
+    async def set_slug_id(self, slug_id: str) -> None:
+        """
+        Sets the slug_id of the report, then gathers the data for that report
+        :param slug_id: The slug_id to be set
+        :return: None
+        """
+        self.slug_id = slug_id
+        self.report_url = self.create_api_url(slug_id=self.slug_id)
+        await self.load()
+
+    def __repr__(self):
+        return f"AsyncReport(slug_id={self.slug_id})"
+
+    def __str__(self):
+        return f"AsyncReport(slug_id={self.slug_id})"
+
+
+class AsyncMarket(AsyncApiBase, Market):
+    """
+    Async counterpart of Market, validation and payload building are inherited from Market
+    """
+
+    async def refresh_data(self) -> None:
+        """
+        Refreshes the data for the given market and stores it in the data attribute as a pandas dataframe
+        """
+        _url = self.create_api_url()
+        chunks = await asyncio.gather(*[self.get_data(_url, x) for x in self.payloads()])
+        self.set_data(merge_rows(chunks, dedupe=False))
+
+
+class AsyncMyMarketNews(AsyncApiBase, MyMarketNews):
+    """
+    Async counterpart of MyMarketNews, the lookups load the report listing asynchronously and then reuse the
+    MyMarketNews implementation on the loaded listing
+    """
+
+    async def slug_check(self, slug_id: str) -> bool:
+        """
+        returns if the report, based on the slug id the user wants to fetch, exists.
+
+        :param slug_id: The id of the report being fetched
+        :return: whether or not the report exists
+        """
+        if not isinstance(slug_id, str):
+            raise TypeError(f"slug_id must be a string")
+
+        if await self.get_data(self.report_base_url + slug_id) is None:
+            return False
+        return True
+
+    async def get_current_reports(self, force: bool = False) -> pd.DataFrame:
+        """
+        The listing is shared through the catalog cache and revalidated once stale, concurrent callers share a
+        single revalidation, see MyMarketNews.get_current_reports
+
+        :param force: If True the listing is revalidated even if the cached one is still fresh
+        :return: returns every current report as a dataframe
+        """
+        self._current_reports = self.optimize_current_reports(await self.catalog.get_conditional_async(
+            self.catalog_key(), self.fetch_current_reports, force=force))
+        return self._current_reports
+
+    async def fetch_current_reports(self, reports: pd.DataFrame = None,
+                                    validators: dict = None) -> Tuple[Optional[pd.DataFrame], dict]:
+        """
+        Downloads the report listing unless the cached listing is still current, see
+        MyMarketNews.fetch_current_reports
+        """
+        validators = validators or {}
+        if reports is not None and not (validators.get("etag") or validators.get("last_modified")):
+            latest = self.latest_published(reports)
+            probe = None
+            if latest is not None:
+                try:
+                    probe = (await self.get_conditional(self.catalog_probe_url(latest)))[0] or []
+                except aiohttp.ClientResponseError:
+                    pass
+            if probe is not None:
+                if not self.published_since(probe, latest):
+                    return None, validators
+                if len(probe) >= len(reports):
+                    return self.build_current_reports(probe), {}
+            data, validators = await self.get_conditional(self.report_base_url)
+        else:
+            data, validators = await self.get_conditional(self.report_base_url,
+                                                          validators if reports is not None else None)
+            if data is None:
+                return None, validators
+        return self.build_current_reports(data), validators
+
+    async def get_report_index(self, refresh_reports: bool = False) -> ReportIndex:
+        """
+        returns the index of the current reports, see MyMarketNews.get_report_index
+        """
+        if self._current_reports is None or refresh_reports:
+            await self.get_current_reports()
+        return self.index_current_reports()
+
+    async def date_check(self, slug_id: str, desired_date: datetime.date, refresh_reports: bool = False,
+                         search_type: str = "before") -> bool:
+        """
+        returns if the desired date exists or not for the report being fetched, see MyMarketNews.date_check
+        """
+        if (not isinstance(slug_id, str)) or (not isinstance(desired_date, datetime.date)):
+            raise TypeError(f"Make sure both {slug_id} is of type string and {desired_date} is of type datetime.date")
+
+        return (await self.get_report_index(refresh_reports)).has_date(slug_id, desired_date, search_type)
+
+    async def get_report_info(self, slud_id: str, column_names: list = None) -> dict:
+        """
+        return a description of a given report, see MyMarketNews.get_report_info
+        """
+        if not isinstance(slud_id, str):
+            raise TypeError(f"slug_id must be a string")
+
+        return self.describe_report(await self.get_report_index(), slud_id, column_names)
+
+    async def get_report_title(self, slug_id: str) -> str:
+        """
+        return the title of a given report
+        """
+        return (await self.get_report_info(slug_id, ["title"])).get("title")
+
+    async def get_report_slug_name(self, slug_id: str) -> str:
+        """
+        return the slug name of a given report
+        """
+        return (await self.get_report_info(slug_id, ["slug_name"])).get("slug_name")
+
+    async def get_report_slug_id(self, slug_id: str) -> str:
+        """
+        return the slug id of a given report
+        """
+        return (await self.get_report_info(slug_id, ["slug_id"])).get("slug_id", None)
+
+    def iter_pages(self, slug_id: str, begin_date=None, end_date=None, window_days: int = None,
+                   batch_size: int = DEFAULT_BATCH_SIZE) -> AsyncIterator[List[dict]]:
+        """
+        Streams a report in batches of rows, see MyMarketNews.iter_pages
+
+        :return: An async iterator over lists of result rows
+        """
+        return self.iter_report_data(slug_id, begin_date=begin_date, end_date=end_date, window_days=window_days,
+                                     batch_size=batch_size)
+
+    async def iter_rows(self, slug_id: str, begin_date=None, end_date=None, window_days: int = None,
+                        batch_size: int = DEFAULT_BATCH_SIZE) -> AsyncIterator[dict]:
+        """
+        Streams a report row by row, see MyMarketNews.iter_pages
+
+        :return: An async iterator over the result rows
+        """
+        async for batch in self.iter_pages(slug_id, begin_date, end_date, window_days, batch_size):
+            for row in batch:
+                yield row
+
+    async def single_date(self, slug_id: str, begin_date, key):
+        """
+        Function can be called to get a single data point from a single report, see MyMarketNews.single_date
+        """
+        _data = await self.get_data(self.report_base_url + slug_id + "?q=report_begin_date=" + begin_date)
+
+        for row in _data or []:
+            print(row[key])
+
+    async def time_series(self, slug_id: str, values=None, begin_date=None, end_date=None, by="commodity",
+                          date_column: str = "report_date", freq: str = None, agg: str = "mean", layout: str = "wide",
+                          ffill: bool = False, window_days: int = None, workers: int = None) -> pd.DataFrame:
+        """
+        Gets a report as date indexed time series per commodity and metric, see MyMarketNews.time_series. The
+        windows are fetched concurrently, capped by the transport semaphore rather than by workers
+        """
+        from MyMarketNewsUSDA.TimeSeries import time_series
+
+        frame = await self.get_report_frame(slug_id, begin_date=begin_date, end_date=end_date,
+                                            window_days=window_days)
+        return time_series(frame, values=values, date_column=date_column, by=by, freq=freq, agg=agg, layout=layout,
+                           ffill=ffill)
+
+    async def fetch_many(self, slug_ids: Iterable[str], begin_date=None, end_date=None, workers: int = DEFAULT_WORKERS,
+                         window_days: int = None, join: bool = False, values=None, by="commodity",
+                         date_column: str = "report_date",
+                         agg: str = "mean") -> Union[Dict[str, pd.DataFrame], pd.DataFrame]:
+        """
+        Fetches many reports concurrently, see MyMarketNews.fetch_many. At most workers reports are fetched at once,
+        the windows of a report are fetched concurrently within the transport semaphore. A report that fails does not
+        abort the others, its exception is stored in the fetch_errors attribute under its slug id
+        """
+        if workers is None or workers < 1:
+            raise ValueError(f"workers must be at least 1, not {workers}")
+        slug_ids = list(dict.fromkeys(str(x) for x in slug_ids))
+        semaphore = asyncio.Semaphore(workers)
+
+        async def fetch(slug_id: str) -> pd.DataFrame:
+            async with semaphore:
+                return await self.get_report_frame(slug_id, begin_date=begin_date, end_date=end_date,
+                                                   window_days=window_days)
+
+        results = await asyncio.gather(*[fetch(x) for x in slug_ids], return_exceptions=True)
+        for result in results:
+            # only errors of a report are kept per slug id, cancellation and interrupts are raised
+            if isinstance(result, BaseException) and not isinstance(result, Exception):
+                raise result
+        self.fetch_errors = {x: result for x, result in zip(slug_ids, results) if isinstance(result, Exception)}
+        frames = {x: result for x, result in zip(slug_ids, results) if not isinstance(result, Exception)}
+        if not join:
+            return frames
+        return self.join_reports(frames, values=values, by=by, date_column=date_column, agg=agg)
+
+    async def get_reports(self, slug_ids: Iterable[str]) -> Dict[str, list]:
+        """
+        Fetches many reports concurrently, the transport semaphore caps how many are in flight at once
+
+        :param slug_ids: The IDs of the reports being fetched
+        :return: a dict mapping every slug id to its report data
+        """
+        slug_ids = list(slug_ids)
+        results = await asyncio.gather(*[self.get_data(self.create_api_url(slug_id=x)) for x in slug_ids])
+        return dict(zip(slug_ids, results))
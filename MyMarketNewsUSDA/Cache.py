@@ -0,0 +1,182 @@
+"""
+Author: Jacob Dallas
+
+Persistent SQLite backed cache of API results. Report dates far enough in the past never change on the USDA side, so
+results whose date window lies entirely in the past are kept forever, while windows reaching today expire quickly.
+"""
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "MyMarketNewsUSDA", "responses.sqlite3")
+DEFAULT_TTL = 60 * 60
+DEFAULT_RECENT_TTL = 5 * 60
+DEFAULT_SETTLE_DAYS = 7
+
+# query parameters that do not change the response and must never be written to disk
+_IGNORED_QUERY_PARAMETERS = {"key"}
+
+
+def _parse_api_date(value: str) -> Optional[datetime.date]:
+    try:
+        return datetime.datetime.strptime(str(value).strip(), "%m/%d/%Y").date()
+    except ValueError:
+        return None
+
+
+def canonical_url(_url: str) -> str:
+    """
+    Normalizes a URL so that equivalent requests produce the same string: the scheme and host are lower cased, query
+    parameters are sorted and the api key parameter is dropped
+    :param _url: The URL to normalize
+    :return: The canonical URL
+    """
+    parts = urlsplit(_url)
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                   if k not in _IGNORED_QUERY_PARAMETERS)
+    query = "&".join(f"{k}={v}" for k, v in query)
+    return f"{parts.scheme.lower()}://{parts.netloc.lower()}{parts.path}" + (f"?{query}" if query else "")
+
+
+def request_key(_url: str, payload: dict = None) -> str:
+    """
+    Builds the key identifying a request from its canonical URL and its payload
+    :param _url: The URL of the request
+    :param payload: The POST payload of the request, if any
+    :return: A hex digest identifying the request
+    """
+    canonical = canonical_url(_url) + "\n" + json.dumps(payload or {}, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def request_date_window(_url: str, payload: dict = None) -> Tuple[Optional[datetime.date], Optional[datetime.date]]:
+    """
+    Finds the report date window requested by a report URL or a market payload
+    :param _url: The URL of the request
+    :param payload: The POST payload of the request, if any
+    :return: The (begin, end) dates of the window, either may be None if it is open ended
+    """
+    if payload and payload.get("DATE"):
+        dates = payload["DATE"]
+        return _parse_api_date(dates[0]), _parse_api_date(dates[-1]) if len(dates) > 1 else None
+    query = dict(parse_qsl(urlsplit(_url).query))
+    begin_date = query.get("q", "")
+    begin_date = _parse_api_date(begin_date.split("=", 1)[1]) if begin_date.startswith("report_begin_date=") else None
+    end_date = query.get("report_end_date")
+    return begin_date, _parse_api_date(end_date) if end_date is not None else None
+
+
+class ResponseCache:
+    """
+    SQLite backed cache of API results with per entry TTLs, safe to share between threads and instances
+
+    :param path: The SQLite database file, ":memory:" keeps the cache in process only
+    :param default_ttl: Seconds a result without a fully historical date window is kept
+    :param recent_ttl: Seconds a result whose date window reaches today (or is open ended) is kept
+    :param settle_days: A window ending more than this many days ago is considered immutable and never expires
+    """
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, default_ttl: float = DEFAULT_TTL,
+                 recent_ttl: float = DEFAULT_RECENT_TTL, settle_days: int = DEFAULT_SETTLE_DAYS):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.default_ttl = default_ttl
+        self.recent_ttl = recent_ttl
+        self.settle_days = settle_days
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        import sqlite3
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS responses ("
+                                     "key TEXT PRIMARY KEY, url TEXT, body TEXT, created_at REAL, expires_at REAL)")
+
+    def ttl_for(self, _url: str, payload: dict = None) -> Optional[float]:
+        """
+        Picks the TTL for a request based on its date window
+        :param _url: The URL of the request
+        :param payload: The POST payload of the request, if any
+        :return: The TTL in seconds, or None if the result is immutable
+        """
+        begin_date, end_date = request_date_window(_url, payload)
+        if begin_date is None and end_date is None:
+            return self.default_ttl
+        today = datetime.date.today()
+        if end_date is None or end_date >= today:
+            return self.recent_ttl
+        if end_date < today - datetime.timedelta(days=self.settle_days):
+            return None
+        return self.default_ttl
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Gets a cached result, counting the lookup as a hit or a miss
+        :param key: The request key, see request_key
+        :return: The cached result, or None if it is missing or expired
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT body, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or (row[1] is not None and row[1] <= time.time()):
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any, ttl: Optional[float], _url: str = None) -> None:
+        """
+        Stores a result
+        :param key: The request key, see request_key
+        :param value: The JSON serializable result
+        :param ttl: Seconds until the entry expires, None to keep it forever
+        :param _url: The canonical URL of the request, only stored to make the database inspectable
+        :return: None
+        """
+        now = time.time()
+        body = json.dumps(value)
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                                     (key, _url, body, now, None if ttl is None else now + ttl))
+
+    def purge_expired(self) -> int:
+        """
+        Deletes every expired entry
+        :return: The number of deleted entries
+        """
+        with self._lock, self._connection:
+            return self._connection.execute("DELETE FROM responses WHERE expires_at IS NOT NULL AND expires_at <= ?",
+                                            (time.time(),)).rowcount
+
+    def clear(self) -> None:
+        """
+        Deletes every entry and resets the counters
+        """
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM responses")
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        """
+        :return: the hit and miss counters, the hit rate and the number of stored entries
+        """
+        with self._lock:
+            entries = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "entries": entries}
+
+    def close(self) -> None:
+        """
+        Closes the SQLite connection
+        """
+        with self._lock:
+            self._connection.close()
+
+    def __repr__(self):
+        return f"ResponseCache(path={self.path!r}, hits={self.hits}, misses={self.misses})"
@@ -0,0 +1,289 @@
+"""
+Author: Jacob Dallas
+
+Process wide cache of the report catalog (the listing of every current report), shared by all MyMarketNews instances.
+"""
+import threading
+import time
+import weakref
+import datetime
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_CATALOG_TTL = 15 * 60
+# revalidation cannot notice reports being removed from the listing, so it is downloaded in full at least this often
+DEFAULT_CATALOG_MAX_AGE = 24 * 60 * 60
+
+
+class ReportIndex:
+    """
+    Index of a report catalog keyed by slug_id, holding the row positions and the sorted report dates of every slug so
+    that existence checks run in constant time and date searches in logarithmic time
+
+    :param frame: The report catalog, as built by MyMarketNews.build_current_reports
+    :param date_column: The column holding the report dates
+    """
+    def __init__(self, frame: pd.DataFrame, date_column: str = "report_date"):
+        self.frame = frame
+        self.date_column = date_column
+        self.columns = frozenset(frame.columns)
+        self._positions: Dict[str, np.ndarray] = {}
+        self._dates: Dict[str, np.ndarray] = {}
+        if "slug_id" not in frame.columns or frame.empty:
+            return
+        _dates = frame[date_column].to_numpy() if date_column in frame.columns else None
+        for slug_id, positions in frame.groupby(frame["slug_id"].astype(str), sort=False).indices.items():
+            self._positions[slug_id] = positions
+            if _dates is not None:
+                slug_dates = _dates[positions]
+                self._dates[slug_id] = np.sort(slug_dates[~pd.isna(slug_dates)])
+
+    def __contains__(self, slug_id: str) -> bool:
+        return slug_id in self._positions
+
+    def __len__(self):
+        return len(self._positions)
+
+    def positions(self, slug_id: str) -> np.ndarray:
+        """
+        :param slug_id: The ID of the report
+        :return: the row positions of the report in the catalog, empty if the slug_id is unknown
+        """
+        return self._positions.get(slug_id, np.empty(0, dtype=np.intp))
+
+    def rows(self, slug_id: str) -> pd.DataFrame:
+        """
+        :param slug_id: The ID of the report
+        :return: the catalog rows of the report
+        """
+        return self.frame.iloc[self.positions(slug_id)]
+
+    def value(self, slug_id: str, column: str):
+        """
+        :param slug_id: The ID of the report
+        :param column: The catalog column to read
+        :return: the value of the column in the first row of the report, or None if the slug_id is unknown
+        """
+        positions = self._positions.get(slug_id)
+        if positions is None or len(positions) == 0:
+            return None
+        return self.frame[column].values[positions[0]]
+
+    def has_date(self, slug_id: str, desired_date: datetime.date, search_type: str = "before") -> bool:
+        """
+        Checks the report dates of a report against a date
+        :param slug_id: The ID of the report
+        :param desired_date: The date to search for
+        :param search_type: "exact" for a report on that date, "before" for one on or after it, "after" for one on or
+            before it (the naming follows MyMarketNews.date_check)
+        :return: whether a matching report date exists
+        """
+        if slug_id not in self._positions:
+            return False
+        if search_type not in ("exact", "before", "after"):
+            return True
+        _dates = self._dates.get(slug_id)
+        if _dates is None or len(_dates) == 0:
+            return False
+        desired_date = np.datetime64(pd.Timestamp(desired_date)).astype(_dates.dtype)
+        if search_type == "exact":
+            position = np.searchsorted(_dates, desired_date)
+            return bool(position < len(_dates) and _dates[position] == desired_date)
+        elif search_type == "before":
+            return bool(_dates[-1] >= desired_date)
+        return bool(_dates[0] <= desired_date)
+
+
+class _CatalogEntry:
+    def __init__(self):
+        self.frame: Optional[pd.DataFrame] = None
+        self.index: Optional[ReportIndex] = None
+        self.fetched_at: float = 0.0
+        self.downloaded_at: float = 0.0
+        self.validators: dict = {}
+        self.lock = threading.Lock()
+        # the asyncio lock of every event loop refreshing the entry, see CatalogCache.get_conditional_async
+        self.async_locks = weakref.WeakKeyDictionary()
+
+
+class CatalogCache:
+    """
+    TTL bounded cache of report catalogs keyed by the URL they were downloaded from, or by a tuple starting with that
+    URL (see MyMarketNews.catalog_key) so that clients with other transports or API keys get catalogs of their own
+
+    Refreshes are single flight: when an entry is stale the first caller downloads it while every other caller for the
+    same key waits for that download and reuses its result. The cached dataframe is shared, treat it as read only.
+    Stale entries can be revalidated instead of downloaded again, see get_conditional.
+
+    :param ttl: Seconds a downloaded catalog is considered fresh
+    :param max_age: Seconds after which a catalog is downloaded in full even if it revalidates as unchanged
+    """
+    def __init__(self, ttl: float = DEFAULT_CATALOG_TTL, max_age: float = DEFAULT_CATALOG_MAX_AGE):
+        self.ttl = ttl
+        self.max_age = max_age
+        self.downloads = 0
+        self.revalidations = 0
+        self._entries: Dict[Hashable, _CatalogEntry] = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, key: Hashable) -> _CatalogEntry:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _CatalogEntry()
+            return entry
+
+    def _is_fresh(self, entry: _CatalogEntry) -> bool:
+        return entry.frame is not None and time.monotonic() - entry.fetched_at < self.ttl
+
+    def peek(self, key: Hashable) -> Optional[pd.DataFrame]:
+        """
+        :param key: The key of the catalog
+        :return: the cached catalog if it is still fresh, otherwise None
+        """
+        entry = self._entry(key)
+        return entry.frame if self._is_fresh(entry) else None
+
+    def put(self, key: Hashable, frame: pd.DataFrame) -> None:
+        """
+        Stores a freshly downloaded catalog
+        :param key: The key of the catalog
+        :param frame: The catalog
+        :return: None
+        """
+        entry = self._entry(key)
+        with entry.lock:
+            entry.frame = frame
+            entry.fetched_at = entry.downloaded_at = time.monotonic()
+            entry.validators = {}
+            self.downloads += 1
+
+    def get(self, key: Hashable, load: Callable[[], pd.DataFrame], force: bool = False) -> pd.DataFrame:
+        """
+        Gets the catalog, downloading it with load if it is missing or stale
+        :param key: The key of the catalog
+        :param load: Downloads and builds the catalog
+        :param force: If True the catalog is downloaded even if it is fresh, concurrent forced callers still share a
+            single download
+        :return: The catalog
+        """
+        return self.get_conditional(key, lambda frame, validators: (load(), {}), force=force)
+
+    def get_conditional(self, key: Hashable,
+                        fetch: Callable[[Optional[pd.DataFrame], dict], Tuple[Optional[pd.DataFrame], dict]],
+                        force: bool = False) -> pd.DataFrame:
+        """
+        Gets the catalog like get, but a stale catalog is revalidated: fetch is given the cached catalog and the
+        validators stored with it (e.g. its ETag) and returns None when the catalog did not change, so that the cached
+        frame is kept without downloading or parsing the listing again
+        :param key: The key of the catalog
+        :param fetch: Called as fetch(cached frame, validators) and returns (frame, validators), the frame is None if
+            the cached one is unchanged. The cached frame is None, and a frame must be returned, when there is no
+            cached catalog or it is older than max_age
+        :param force: If True the catalog is revalidated even if it is fresh
+        :return: The catalog
+        """
+        entry = self._entry(key)
+        if not force and self._is_fresh(entry):
+            return entry.frame
+        requested_at = time.monotonic()
+        with entry.lock:
+            # another caller may have refreshed the entry while we were waiting for the lock
+            if self._is_fresh(entry) and (not force or entry.fetched_at >= requested_at):
+                return entry.frame
+            full = entry.frame is None or time.monotonic() - entry.downloaded_at >= self.max_age
+            frame, validators = fetch(None if full else entry.frame, {} if full else dict(entry.validators))
+            return self._store(key, entry, full, frame, validators)
+
+    async def get_conditional_async(self, key: Hashable,
+                                    fetch: Callable[[Optional[pd.DataFrame], dict],
+                                                    Awaitable[Tuple[Optional[pd.DataFrame], dict]]],
+                                    force: bool = False) -> pd.DataFrame:
+        """
+        Coroutine counterpart of get_conditional, fetch is a coroutine function. Concurrent callers on the same event
+        loop share a single revalidation, the entry is only locked against other threads while it is updated
+        :param key: The key of the catalog
+        :param fetch: Called as fetch(cached frame, validators) and awaited, see get_conditional
+        :param force: If True the catalog is revalidated even if it is fresh
+        :return: The catalog
+        """
+        import asyncio
+
+        entry = self._entry(key)
+        if not force and self._is_fresh(entry):
+            return entry.frame
+        requested_at = time.monotonic()
+        loop = asyncio.get_running_loop()
+        with entry.lock:
+            lock = entry.async_locks.get(loop)
+            if lock is None:
+                lock = entry.async_locks[loop] = asyncio.Lock()
+        async with lock:
+            with entry.lock:
+                if self._is_fresh(entry) and (not force or entry.fetched_at >= requested_at):
+                    return entry.frame
+                full = entry.frame is None or time.monotonic() - entry.downloaded_at >= self.max_age
+                cached, validators = (None, {}) if full else (entry.frame, dict(entry.validators))
+            frame, validators = await fetch(cached, validators)
+            with entry.lock:
+                return self._store(key, entry, full, frame, validators)
+
+    def _store(self, key: Hashable, entry: _CatalogEntry, full: bool, frame: Optional[pd.DataFrame],
+               validators: dict) -> pd.DataFrame:
+        entry.fetched_at = time.monotonic()
+        entry.validators = validators or {}
+        if frame is None:
+            if full:
+                raise ValueError(f"The catalog {key} was not downloaded although nothing is cached")
+            self.revalidations += 1
+        else:
+            entry.frame = frame
+            entry.downloaded_at = entry.fetched_at
+            self.downloads += 1
+        return entry.frame
+
+    def index(self, key: Hashable, frame: pd.DataFrame) -> ReportIndex:
+        """
+        Gets the index of a catalog, built once per download and shared like the catalog itself
+        :param key: The key of the catalog
+        :param frame: The catalog to index, a frame that is not the cached one gets an index of its own
+        :return: The index of the catalog
+        """
+        entry = self._entry(key)
+        with entry.lock:
+            if entry.frame is not frame:
+                return ReportIndex(frame)
+            if entry.index is None or entry.index.frame is not frame:
+                entry.index = ReportIndex(frame)
+            return entry.index
+
+    def invalidate(self, key: Hashable = None) -> None:
+        """
+        Drops a cached catalog, or every cached catalog if no key is given. A URL drops the catalogs of every client
+        downloading from it
+        :param key: The key or the URL of the catalog
+        :return: None
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+                for cached in [x for x in self._entries if isinstance(x, tuple) and x and x[0] == key]:
+                    del self._entries[cached]
+
+    def __repr__(self):
+        return f"CatalogCache(ttl={self.ttl}, downloads={self.downloads}, revalidations={self.revalidations})"
+
+
+_shared_catalog = CatalogCache()
+
+
+def get_shared_catalog() -> CatalogCache:
+    """
+    Returns the process wide catalog cache used by every MyMarketNews instance that was not given its own
+    :return: The shared CatalogCache
+    """
+    return _shared_catalog
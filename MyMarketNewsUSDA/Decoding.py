@@ -0,0 +1,284 @@
+"""
+Author: Jacob Dallas
+
+Fast, schema aware decoding of API responses. Bodies are decoded with orjson or msgspec when one of them is installed,
+and the result rows are turned into typed columns in one pass, so that dates and numbers are parsed once instead of
+being left as strings for pandas to re-infer.
+"""
+import json
+from typing import Any, Dict, Iterable, List
+
+import numpy as np
+import pandas as pd
+
+try:
+    import orjson
+
+    def loads(content: bytes) -> Any:
+        """
+        Decodes a JSON body with orjson
+        """
+        return orjson.loads(content)
+
+    JSON_BACKEND = "orjson"
+except ImportError:
+    try:
+        import msgspec
+
+        _msgspec_decoder = msgspec.json.Decoder()
+
+        def loads(content: bytes) -> Any:
+            """
+            Decodes a JSON body with msgspec
+            """
+            return _msgspec_decoder.decode(content)
+
+        JSON_BACKEND = "msgspec"
+    except ImportError:
+        def loads(content: bytes) -> Any:
+            """
+            Decodes a JSON body with the standard library
+            """
+            return json.loads(content)
+
+        JSON_BACKEND = "json"
+
+DEFAULT_DATE_FORMAT = "%m/%d/%Y"
+COLUMN_TYPES = ("str", "float", "int", "bool", "date", "datetime", "category")
+
+
+TRUE_VALUES = ("true", "yes", "y", "1")
+# identifiers hold digits but are labels, they are never parsed as numbers
+IDENTIFIER_COLUMNS = ("slug_id",)
+IDENTIFIER_SUFFIXES = ("_id", "_code", "_zip")
+
+
+def is_identifier(column: str) -> bool:
+    """
+    :param column: A column name
+    :return: whether the column holds identifiers, e.g. slug_id or office_code, rather than measurements
+    """
+    column = str(column)
+    return column in IDENTIFIER_COLUMNS or column.endswith(IDENTIFIER_SUFFIXES)
+
+
+def _series(values) -> pd.Series:
+    return values if isinstance(values, pd.Series) else pd.Series(values, dtype="object")
+
+
+def _to_float(values) -> np.ndarray:
+    series = _series(values)
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        return series.to_numpy(dtype="float64", na_value=np.nan)
+    # .str leaves the values that are not text missing, they are put back before parsing
+    text = series.str.replace(",", "", regex=False).str.strip()
+    if series.dtype == object:
+        text = text.where(text.notna(), series)
+    return pd.to_numeric(text, errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+
+
+def _to_datetime(values, date_format: str = None) -> pd.Series:
+    series = _series(values)
+    if date_format is not None:
+        parsed = pd.to_datetime(series, format=date_format, errors="coerce")
+        # fall back to inference if the column does not use the expected format at all
+        if not (parsed.isna().all() and (series.notna() & (series != "")).any()):
+            return parsed
+    return pd.to_datetime(series, errors="coerce")
+
+
+class ReportSchema:
+    """
+    Column types of a report, used to decode result rows straight into typed columns
+
+    :param columns: Maps column names to one of "str", "float", "int", "bool", "date", "datetime" or "category".
+        "date" columns are parsed with date_format, "datetime" columns with format inference
+    :param date_format: The format of "date" columns
+    :param keep_unknown: If True, columns missing from the schema are kept as they were returned
+    """
+    def __init__(self, columns: Dict[str, str], date_format: str = DEFAULT_DATE_FORMAT, keep_unknown: bool = True):
+        for column, column_type in columns.items():
+            if column_type not in COLUMN_TYPES:
+                raise ValueError(f"The type of column {column} must be one of {COLUMN_TYPES}, not {column_type}")
+        self.columns = dict(columns)
+        self.date_format = date_format
+        self.keep_unknown = keep_unknown
+
+    def convert(self, column: str, values):
+        """
+        Converts the raw values of a column to the type given by the schema
+        :param column: The column name
+        :param values: The raw values, as a list or a Series
+        :return: The typed values
+        """
+        column_type = self.columns.get(column, "str")
+        if column_type == "float":
+            return _to_float(values)
+        if column_type == "int":
+            return pd.array(np.round(_to_float(values)), dtype="Int64")
+        if column_type == "bool":
+            series = _series(values)
+            flags = series.astype(str).str.strip().str.lower().isin(TRUE_VALUES).astype("boolean")
+            return flags.mask(series.isna())
+        if column_type == "date":
+            return _to_datetime(values, self.date_format)
+        if column_type == "datetime":
+            return _to_datetime(values)
+        if column_type == "category":
+            return _series(values).astype("category")
+        return values
+
+    def columns_from_rows(self, rows: List[dict]) -> Dict[str, Any]:
+        """
+        Turns result rows into typed columns. The rows are laid out as columns by pandas and every column is then
+        converted as a whole, columns of the schema missing from the rows are left out
+        :param rows: The result rows
+        :return: An ordered dict of column name to typed values
+        """
+        frame = pd.DataFrame.from_records(rows)
+        names = list(frame.columns) if self.keep_unknown else [x for x in self.columns if x in frame.columns]
+        return {name: self.convert(name, frame[name]) for name in names}
+
+    def frame(self, rows: List[dict]) -> pd.DataFrame:
+        """
+        Builds a typed dataframe from result rows
+        :param rows: The result rows
+        :return: The dataframe
+        """
+        if not rows:
+            return pd.DataFrame(columns=list(self.columns))
+        return pd.DataFrame(self.columns_from_rows(rows))
+
+    def __repr__(self):
+        return f"ReportSchema({self.columns})"
+
+
+class FrameBuffer:
+    """
+    Builds a typed dataframe from batches of result rows as they are streamed. Every batch is converted to typed
+    columns by the schema straight away and its rows are dropped, repeated strings are shared, so memory use stays
+    close to the size of the final frame instead of holding the body, the decoded rows and the frame at once
+
+    :param schema: The ReportSchema used to parse the columns
+    """
+    def __init__(self, schema: ReportSchema):
+        self.schema = schema
+        self.rows = 0
+        self._chunks: Dict[str, list] = {}
+        self._strings: Dict[str, dict] = {}
+
+    def append(self, rows: List[dict]) -> None:
+        """
+        Converts a batch of result rows into the column buffers
+        :param rows: The result rows
+        """
+        if not rows:
+            return
+        columns = self.schema.columns_from_rows(rows)
+        for name in self._chunks:
+            if name not in columns:
+                columns[name] = self.schema.convert(name, [None] * len(rows))
+        for name, values in columns.items():
+            chunks = self._chunks.get(name)
+            if chunks is None:
+                # a column first seen in this batch is missing from every earlier row
+                chunks = self._chunks[name] = [self.schema.convert(name, [None] * self.rows)] if self.rows else []
+            if self.schema.columns.get(name, "str") == "str":
+                # kept as plain values until the frame is built, so that pandas infers their dtype over every row
+                strings = self._strings.setdefault(name, {})
+                values = [strings.setdefault(x, x) if isinstance(x, str) else x for x in values]
+            elif isinstance(values, pd.Series):
+                values = values.reset_index(drop=True)
+            chunks.append(values)
+        self.rows += len(rows)
+
+    def extend(self, batches: Iterable[List[dict]]) -> "FrameBuffer":
+        """
+        Appends every batch of an iterator of batches, e.g. ApiBase.iter_data
+        :param batches: The batches of result rows
+        :return: The buffer
+        """
+        for batch in batches:
+            self.append(batch)
+        return self
+
+    def frame(self) -> pd.DataFrame:
+        """
+        :return: the buffered rows as a typed dataframe
+        """
+        if not self.rows:
+            return pd.DataFrame(columns=list(self.schema.columns))
+        return pd.DataFrame({name: _concat(chunks) for name, chunks in self._chunks.items()})
+
+    def __len__(self):
+        return self.rows
+
+    def __repr__(self):
+        return f"FrameBuffer(rows={self.rows}, columns={len(self._chunks)})"
+
+
+def _concat(chunks: list):
+    if len(chunks) == 1:
+        return chunks[0]
+    if all(isinstance(x, list) for x in chunks):
+        return [y for x in chunks for y in x]
+    if all(isinstance(x, np.ndarray) for x in chunks):
+        return np.concatenate(chunks)
+    if all(isinstance(getattr(x, "dtype", None), pd.CategoricalDtype) for x in chunks):
+        # chunks holding only missing values have no categories, give them the categories dtype of the others
+        empty = pd.CategoricalDtype(pd.Index([], dtype=next(
+            (x.dtype.categories.dtype for x in chunks if len(x.dtype.categories)), object)))
+        return pd.api.types.union_categoricals([x if len(x.dtype.categories) else x.astype(empty) for x in chunks])
+    return pd.concat([pd.Series(x) for x in chunks], ignore_index=True)
+
+
+CATALOG_SCHEMA = ReportSchema({"report_date": "datetime", "published_date": "datetime"})
+REPORT_SCHEMAS: Dict[str, ReportSchema] = {}
+
+
+def register_schema(slug_id: str, schema: ReportSchema) -> None:
+    """
+    Registers the schema used to decode a report
+    :param slug_id: The ID of the report
+    :param schema: The schema of the report
+    :return: None
+    """
+    REPORT_SCHEMAS[str(slug_id)] = schema
+
+
+def get_schema(slug_id: str) -> ReportSchema:
+    """
+    :param slug_id: The ID of the report
+    :return: the registered schema of the report, or a schema parsing report_date and published_date only
+    """
+    return REPORT_SCHEMAS.get(str(slug_id), CATALOG_SCHEMA)
+
+
+def infer_schema(rows: Iterable[dict], sample_size: int = 1000,
+                 date_format: str = DEFAULT_DATE_FORMAT) -> ReportSchema:
+    """
+    Guesses a schema from a sample of result rows: columns whose values all parse as numbers become "float" (unless
+    they hold identifiers, see is_identifier), columns whose values all parse with date_format become "date",
+    everything else stays "str"
+    :param rows: The result rows
+    :param sample_size: The number of rows inspected
+    :param date_format: The format tried on text columns
+    :return: The inferred schema
+    """
+    sample = []
+    for row in rows:
+        sample.append(row)
+        if len(sample) >= sample_size:
+            break
+    columns = {}
+    for name in dict.fromkeys(x for row in sample for x in row):
+        values = [row.get(name) for row in sample if row.get(name) not in (None, "")]
+        if not values or is_identifier(name) or any(isinstance(x, (dict, list, bool)) for x in values):
+            columns[name] = "str"
+        elif not np.isnan(_to_float(values)).any():
+            columns[name] = "float"
+        elif not pd.isna(pd.to_datetime(values, format=date_format, errors="coerce")).any():
+            columns[name] = "date"
+        else:
+            columns[name] = "str"
+    return ReportSchema(columns, date_format=date_format)
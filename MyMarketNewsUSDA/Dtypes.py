@@ -0,0 +1,111 @@
+"""
+Author: Jacob Dallas
+
+Memory optimization of the dataframes built from API results. Repeated strings become categoricals, numbers sent as
+strings become (downcast) numeric columns and date columns are parsed with an explicit format.
+"""
+from typing import Dict, Iterable
+
+import pandas as pd
+
+from MyMarketNewsUSDA.Decoding import DEFAULT_DATE_FORMAT, is_identifier
+
+DEFAULT_MAX_CATEGORY_RATIO = 0.5
+CATEGORICAL_COLUMNS = ("commodity", "region", "class", "market_types", "office", "office_name", "office_code",
+                       "market_location_name", "market_location_state", "market_type", "slug_name", "organic")
+
+
+def frame_memory(frame: pd.DataFrame) -> int:
+    """
+    :param frame: The dataframe to measure
+    :return: the memory used by the dataframe in bytes, including the contents of object columns
+    """
+    return int(frame.memory_usage(deep=True).sum())
+
+
+def _is_text(series: pd.Series) -> bool:
+    return series.dtype == object or pd.api.types.is_string_dtype(series.dtype)
+
+
+def _to_numeric(series: pd.Series, downcast_floats: bool):
+    values = series.astype(str).str.replace(",", "", regex=False).str.strip().where(series.notna())
+    numeric = pd.to_numeric(values, errors="coerce")
+    # only convert if every value that was present is a number
+    if (numeric.isna() & series.notna()).any() or numeric.isna().all():
+        return None
+    if not numeric.isna().any() and (numeric % 1 == 0).all():
+        return pd.to_numeric(numeric, downcast="integer")
+    return pd.to_numeric(numeric, downcast="float") if downcast_floats else numeric.astype("float64")
+
+
+def optimize_frame(frame: pd.DataFrame, date_columns: Dict[str, str] = None,
+                   categorical_columns: Iterable[str] = CATEGORICAL_COLUMNS,
+                   max_category_ratio: float = DEFAULT_MAX_CATEGORY_RATIO, downcast_floats: bool = False,
+                   infer_dates: bool = True) -> pd.DataFrame:
+    """
+    Returns a copy of a dataframe with memory efficient dtypes
+    :param frame: The dataframe to optimize
+    :param date_columns: Maps date columns to their strptime format, they are parsed with that format
+    :param categorical_columns: Text columns that always become categoricals
+    :param max_category_ratio: Other text columns become categoricals if their number of distinct values is at most
+        this fraction of their length
+    :param downcast_floats: If True float columns are downcast to float32, which loses precision past 7 digits
+    :param infer_dates: If True, text columns named "*_date" that fully parse with MM/DD/YYYY are parsed as dates
+    :return: The optimized dataframe
+    """
+    frame = frame.copy()
+    date_columns = dict(date_columns or {})
+    if infer_dates:
+        for column in frame.columns:
+            if str(column).endswith("_date") and column not in date_columns and _is_text(frame[column]):
+                date_columns[column] = DEFAULT_DATE_FORMAT
+    categorical_columns = set(categorical_columns)
+
+    for column in frame.columns:
+        series = frame[column]
+        if column in date_columns:
+            if not _is_text(series):
+                continue
+            parsed = pd.to_datetime(series, format=date_columns[column], errors="coerce")
+            if not (parsed.isna() & series.notna()).any():
+                frame[column] = parsed
+            continue
+        if pd.api.types.is_integer_dtype(series.dtype) and not pd.api.types.is_extension_array_dtype(series.dtype):
+            frame[column] = pd.to_numeric(series, downcast="integer")
+            continue
+        if pd.api.types.is_float_dtype(series.dtype):
+            if downcast_floats:
+                frame[column] = pd.to_numeric(series, downcast="float")
+            continue
+        if not _is_text(series) or len(series) == 0:
+            continue
+        try:
+            distinct = series.nunique(dropna=True)
+        except TypeError:
+            # unhashable values such as lists are left untouched
+            continue
+        # identifiers such as slug_id hold digits but are labels, they stay text
+        if column not in categorical_columns and not is_identifier(column):
+            numeric = _to_numeric(series, downcast_floats)
+            if numeric is not None:
+                frame[column] = numeric
+                continue
+        if column in categorical_columns or distinct <= max_category_ratio * len(series):
+            frame[column] = series.astype("category")
+    return frame
+
+
+def memory_report(before: pd.DataFrame, after: pd.DataFrame) -> dict:
+    """
+    Compares the memory used by a dataframe before and after optimize_frame
+    :param before: The original dataframe
+    :param after: The optimized dataframe
+    :return: the total bytes before and after, their ratio and the bytes before and after of every column
+    """
+    before_columns = before.memory_usage(deep=True, index=False)
+    after_columns = after.memory_usage(deep=True, index=False)
+    before_bytes, after_bytes = frame_memory(before), frame_memory(after)
+    return {"before_bytes": before_bytes, "after_bytes": after_bytes,
+            "ratio": before_bytes / after_bytes if after_bytes else 1.0,
+            "columns": {x: (int(before_columns[x]), int(after_columns[x])) for x in after.columns
+                        if x in before_columns}}
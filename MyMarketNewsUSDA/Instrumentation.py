@@ -0,0 +1,271 @@
+"""
+Author: Jacob Dallas
+
+Request instrumentation. Every API call emits an Event (and every dataframe built from API data a "frame" Event) to
+the subscribed callbacks, and the timings are aggregated in process into latency histograms per report / commodity, so
+that the reports and stages dominating a crawl can be found without any external tooling.
+"""
+import bisect
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# log spaced bucket bounds from 10 microseconds to ~5 minutes, every bucket is ~19% wider than the previous one
+HISTOGRAM_BOUNDS = tuple(1e-5 * 2 ** (x / 4) for x in range(100))
+TIMING_METRICS = ("total_time", "ttfb", "decode_time", "frame_time")
+
+
+class Event:
+    """
+    One instrumented API call ("request" stage) or dataframe build ("frame" stage)
+
+    :param stage: "request" or "frame"
+    :param api_type: "report" or "market"
+    :param label: The slug_id of a report, "catalog" for the report listing or the upper cased commodity of a market
+        query
+    :param url: The URL of the call, without the API key
+    :param payload: The payload of a market call
+    :param method: The HTTP method
+    :param status_code: The HTTP status of the last attempt, None if no request was sent
+    :param attempts: The number of requests sent, retries included
+    :param cache: "hit" or "miss" if a ResponseCache is set, None otherwise
+    :param coalesced: True if the call waited on an identical in-flight call instead of sending a request
+    :param ttfb: Seconds from sending the last attempt until its response headers were parsed. DNS and connect times
+        are not exposed by requests and are included here
+    :param total_time: Seconds the call took, waits on the rate limiter and retries included
+    :param response_bytes: The size of the response body
+    :param decode_time: Seconds spent decoding the body
+    :param frame_time: Seconds spent building a dataframe
+    :param rows: The number of result rows
+    :param error: The exception raised by the call, if any
+    :param timestamp: The wall clock time the call started at
+    """
+    __slots__ = ("stage", "api_type", "label", "url", "payload", "method", "status_code", "attempts", "cache",
+                 "coalesced", "ttfb", "total_time", "response_bytes", "decode_time", "frame_time", "rows", "error",
+                 "timestamp")
+
+    def __init__(self, stage: str, api_type: str, label: str, url: str = None, payload: dict = None,
+                 method: str = None, status_code: int = None, attempts: int = 0, cache: str = None,
+                 coalesced: bool = False, ttfb: float = None, total_time: float = None, response_bytes: int = None,
+                 decode_time: float = None, frame_time: float = None, rows: int = None, error: str = None,
+                 timestamp: float = None):
+        self.stage = stage
+        self.api_type = api_type
+        self.label = label
+        self.url = url
+        self.payload = payload
+        self.method = method
+        self.status_code = status_code
+        self.attempts = attempts
+        self.cache = cache
+        self.coalesced = coalesced
+        self.ttfb = ttfb
+        self.total_time = total_time
+        self.response_bytes = response_bytes
+        self.decode_time = decode_time
+        self.frame_time = frame_time
+        self.rows = rows
+        self.error = error
+        self.timestamp = time.time() if timestamp is None else timestamp
+
+    def to_dict(self) -> dict:
+        """
+        :return: the fields of the event as a dict, e.g. to log it as JSON
+        """
+        return {x: getattr(self, x) for x in self.__slots__}
+
+    def __repr__(self):
+        fields = ", ".join(f"{x}={getattr(self, x)!r}" for x in self.__slots__ if getattr(self, x) is not None)
+        return f"Event({fields})"
+
+
+class Histogram:
+    """
+    Thread safe histogram of durations with log spaced buckets, percentiles are accurate to a bucket width (~19%)
+    """
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self._buckets = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+        self._lock = threading.Lock()
+
+    def add(self, value: float) -> None:
+        """
+        Records a duration
+        :param value: The duration in seconds
+        """
+        with self._lock:
+            self.count += 1
+            self.total += value
+            self.min = value if self.min is None else min(self.min, value)
+            self.max = value if self.max is None else max(self.max, value)
+            self._buckets[bisect.bisect_left(HISTOGRAM_BOUNDS, value)] += 1
+
+    def merge(self, other: "Histogram") -> None:
+        """
+        Adds the recorded durations of another histogram to this one
+        """
+        with other._lock:
+            buckets, count, total, low, high = list(other._buckets), other.count, other.total, other.min, other.max
+        with self._lock:
+            self._buckets = [x + y for x, y in zip(self._buckets, buckets)]
+            self.count += count
+            self.total += total
+            if low is not None:
+                self.min = low if self.min is None else min(self.min, low)
+                self.max = high if self.max is None else max(self.max, high)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """
+        :param q: The percentile, between 0 and 100
+        :return: the upper bound of the bucket holding the percentile (capped by the largest value), None if empty
+        """
+        with self._lock:
+            if self.count == 0:
+                return None
+            rank = max(1, round(self.count * q / 100))
+            seen = 0
+            for position, count in enumerate(self._buckets):
+                seen += count
+                if seen >= rank:
+                    bound = HISTOGRAM_BOUNDS[position] if position < len(HISTOGRAM_BOUNDS) else self.max
+                    return min(bound, self.max)
+            return self.max
+
+    def summary(self) -> dict:
+        """
+        :return: the count, total, mean, min, p50, p90, p99 and max of the recorded durations in seconds
+        """
+        return {"count": self.count, "total": self.total, "mean": self.total / self.count if self.count else None,
+                "min": self.min, "p50": self.percentile(50), "p90": self.percentile(90), "p99": self.percentile(99),
+                "max": self.max}
+
+    def __repr__(self):
+        return f"Histogram(count={self.count}, p50={self.percentile(50)}, p99={self.percentile(99)})"
+
+
+class Instrumentation:
+    """
+    Dispatches Events to subscribed callbacks and aggregates their timings into histograms keyed by
+    (stage, label, metric). Callbacks run on the thread that made the call, exceptions they raise are not propagated
+    """
+    def __init__(self):
+        self.events = 0
+        self.callback_errors = 0
+        self._callbacks: List[Callable[[Event], Any]] = []
+        self._histograms: Dict[Tuple[str, str, str], Histogram] = {}
+        self._counters: Dict[Tuple[str, str, str], int] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback: Callable[[Event], Any]) -> Callable[[Event], Any]:
+        """
+        Subscribes a callback to every Event
+        :param callback: Called with every Event
+        :return: The callback, so that this can be used as a decorator
+        """
+        with self._lock:
+            self._callbacks = self._callbacks + [callback]
+        return callback
+
+    def unsubscribe(self, callback: Callable[[Event], Any]) -> None:
+        """
+        Unsubscribes a callback
+        """
+        with self._lock:
+            self._callbacks = [x for x in self._callbacks if x is not callback]
+
+    def emit(self, event: Event) -> None:
+        """
+        Records an Event and passes it to every callback
+        :param event: The Event
+        """
+        histograms = []
+        with self._lock:
+            self.events += 1
+            if event.cache is not None:
+                key = (event.stage, event.label, f"cache_{event.cache}")
+                self._counters[key] = self._counters.get(key, 0) + 1
+            if event.error is not None:
+                key = (event.stage, event.label, "errors")
+                self._counters[key] = self._counters.get(key, 0) + 1
+            for metric in TIMING_METRICS:
+                value = getattr(event, metric)
+                if value is not None:
+                    key = (event.stage, event.label, metric)
+                    histogram = self._histograms.get(key)
+                    if histogram is None:
+                        histogram = self._histograms[key] = Histogram()
+                    histograms.append((histogram, value))
+            callbacks = self._callbacks
+        for histogram, value in histograms:
+            histogram.add(value)
+        for callback in callbacks:
+            try:
+                callback(event)
+            except Exception:
+                self.callback_errors += 1
+
+    def histogram(self, metric: str = "total_time", stage: str = "request", label: str = None) -> Histogram:
+        """
+        :param metric: One of "total_time", "ttfb", "decode_time" or "frame_time"
+        :param stage: "request" or "frame"
+        :param label: A slug_id, "catalog" or a commodity, if None the histograms of every label are merged
+        :return: the histogram of the metric
+        """
+        merged = Histogram()
+        with self._lock:
+            histograms = [x for (s, l, m), x in self._histograms.items()
+                          if s == stage and m == metric and (label is None or l == label)]
+        for histogram in histograms:
+            merged.merge(histogram)
+        return merged
+
+    def summary(self) -> Dict[str, Dict[str, dict]]:
+        """
+        :return: a nested dict "stage:label" -> metric -> histogram summary (or count for cache outcomes and errors)
+        """
+        with self._lock:
+            histograms = dict(self._histograms)
+            counters = dict(self._counters)
+        summary: Dict[str, Dict[str, Any]] = {}
+        for (stage, label, metric), histogram in sorted(histograms.items()):
+            summary.setdefault(f"{stage}:{label}", {})[metric] = histogram.summary()
+        for (stage, label, metric), count in sorted(counters.items()):
+            summary.setdefault(f"{stage}:{label}", {})[metric] = count
+        return summary
+
+    def top(self, metric: str = "total_time", stage: str = "request", n: int = 10) -> List[Tuple[str, float]]:
+        """
+        :param metric: The timing metric
+        :param stage: "request" or "frame"
+        :param n: The number of labels returned
+        :return: the n labels with the most cumulative time in the metric, with their total seconds
+        """
+        with self._lock:
+            totals = [(l, x.total) for (s, l, m), x in self._histograms.items() if s == stage and m == metric]
+        return sorted(totals, key=lambda x: x[1], reverse=True)[:n]
+
+    def reset(self) -> None:
+        """
+        Clears the aggregated histograms and counters, callbacks stay subscribed
+        """
+        with self._lock:
+            self._histograms = {}
+            self._counters = {}
+            self.events = 0
+
+    def __repr__(self):
+        return f"Instrumentation(events={self.events}, callbacks={len(self._callbacks)})"
+
+
+_default_instrumentation = Instrumentation()
+
+
+def get_default_instrumentation() -> Instrumentation:
+    """
+    Returns the process wide Instrumentation every ApiBase instance reports to
+    :return: The shared Instrumentation
+    """
+    return _default_instrumentation
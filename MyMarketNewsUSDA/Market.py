@@ -1,12 +1,14 @@
-import datetime
-from typing import Union
+from __future__ import annotations
 
-import pandas as pd
+import datetime
+from typing import TYPE_CHECKING, List, Union
 
 from MyMarketNewsUSDA.ApiBase import ApiBase
-from assets.commodities import COMMODITY_DATA, COMMODITY_CLASSES, COMMODITY_REGIONS, COMPOSITE_COMMODITIES, \
-    FRUIT_COMMODITIES, ONIONS_AND_POTATOES_COMMODITIES, VEGETABLES_COMMODITIES, HERBS_COMMODITIES, \
-    ORNAMENTALS_COMMODITIES, HEMP_COMMODITIES
+from MyMarketNewsUSDA.Sharding import DEFAULT_WORKERS, map_ordered, merge_rows, split_date_range
+
+# pandas and the commodity tables are imported where they are first used, so that importing the module stays cheap
+if TYPE_CHECKING:
+    import pandas as pd
 
 # example call that we are trying to mimic
 # base_url = "https://mymarketnews.ams.usda.gov/get_external_api/result"
@@ -38,22 +40,10 @@ def is_commodity(commodity: str) -> bool:
     :param commodity: The commodity to check
     :return: True if the commodity is valid, False otherwise
     """
-    if commodity is None:
-        return False
-    if commodity in FRUIT_COMMODITIES:
-        return True
-    elif commodity in ONIONS_AND_POTATOES_COMMODITIES:
-        return True
-    elif commodity in VEGETABLES_COMMODITIES:
-        return True
-    elif commodity in HERBS_COMMODITIES:
-        return True
-    elif commodity in ORNAMENTALS_COMMODITIES:
-        return True
-    elif commodity in HEMP_COMMODITIES:
-        return True
-    else:
+    if not isinstance(commodity, str):
         return False
+    from assets.commodities import COMMODITY_SET
+    return commodity in COMMODITY_SET
 
 
 def is_commodity_class(commodity_class: str) -> bool:
@@ -62,11 +52,10 @@ def is_commodity_class(commodity_class: str) -> bool:
     :param commodity_class: The commodity class to check
     :return: True if the commodity class is valid, False otherwise
     """
-    if commodity_class is None:
+    if not isinstance(commodity_class, str):
         return False
-    if commodity_class in COMMODITY_CLASSES:
-        return True
-    return False
+    from assets.commodities import COMMODITY_CLASS_SET
+    return commodity_class in COMMODITY_CLASS_SET
 
 
 def is_commodity_region(commodity_region: str) -> bool:
@@ -75,11 +64,10 @@ def is_commodity_region(commodity_region: str) -> bool:
     :param commodity_region: The commodity region to check
     :return: True if the commodity region is valid, False otherwise
     """
-    if commodity_region is None:
+    if not isinstance(commodity_region, str):
         return False
-    if commodity_region in COMMODITY_REGIONS:
-        return True
-    return False
+    from assets.commodities import COMMODITY_REGION_SET
+    return commodity_region in COMMODITY_REGION_SET
 
 
 class Market(ApiBase):
@@ -93,6 +81,14 @@ class Market(ApiBase):
     :param organic: The organic to be set
     :param begin_date: The begin_date to be set
     :param end_date: The end_date to be set
+    :param transport: The Transport to send requests through, defaults to the shared transport
+    :param cache: An optional ResponseCache consulted before every request
+    :param rate_limiter: The per host RateLimiter requests wait on, defaults to the shared limiter
+    :param retry_policy: The RetryPolicy of throttled, failed or unreachable requests
+    :param optimize_dtypes: If True the data is stored with categorical, downcast numeric and parsed date columns,
+        the memory saved is stored in the memory_report attribute
+    :param window_days: If given, the date range is split into windows of this many days requested concurrently
+    :param workers: The maximum number of windows requested concurrently
 
     :return: None
         To access market data use property 'data'
@@ -100,14 +96,19 @@ class Market(ApiBase):
     """
 
     def __init__(self, **kwargs):
-        super().__init__(api_type="market")
-        self.data: pd.DataFrame = pd.DataFrame()
+        super().__init__(api_type="market", transport=kwargs.get("transport", None), cache=kwargs.get("cache", None),
+                         rate_limiter=kwargs.get("rate_limiter", None), retry_policy=kwargs.get("retry_policy", None))
+        self._data = None
         self.commodity = None
         self.region = None
         self.class_ = None
         self.organic = None
         self.begin_date = None
         self.end_date = None
+        self.optimize_dtypes = kwargs.get("optimize_dtypes", False)
+        self.memory_report = None
+        self.window_days = kwargs.get("window_days", None)
+        self.workers = kwargs.get("workers", DEFAULT_WORKERS)
 
         # set the attributes
         self.set_commodity(kwargs.get("commodity", None))
@@ -117,21 +118,32 @@ class Market(ApiBase):
         self.set_begin_date(kwargs.get("begin_date", None))
         self.set_end_date(kwargs.get("end_date", None))
 
+    @property
+    def data(self) -> pd.DataFrame:
+        """
+        The market data, an empty dataframe until refresh_data is run
+        """
+        if self._data is None:
+            import pandas as pd
+            self._data = pd.DataFrame()
+        return self._data
+
+    @data.setter
+    def data(self, data: pd.DataFrame) -> None:
+        self._data = data
+
     def set_commodity(self, commodity: str) -> None:
         """
         Sets the commodity of the market, then gathers the data for that market
         :param commodity: The commodity to be set
         :return: None
         """
+        from assets.commodities import COMMODITY_INDEX, SORTED_COMMODITIES
         commodity = str(commodity).upper()
         if is_commodity(commodity) is False:
-            raise ValueError(
-                f"commodity must be one of the following: {sorted(set([x['commodity'] for x in COMMODITY_DATA]))}")
-        for x in COMMODITY_DATA:
-            if commodity == x['commodity']:
-                self.commodity = commodity
-                self.class_ = x['class']
-                return
+            raise ValueError(f"commodity must be one of the following: {list(SORTED_COMMODITIES)}")
+        self.commodity = commodity
+        self.class_ = COMMODITY_INDEX[commodity]['class']
 
     def set_region(self, region: str) -> None:
         """
@@ -141,7 +153,8 @@ class Market(ApiBase):
         """
         region = region.upper()
         if is_commodity_region(region) is False:
-            raise ValueError(f"region must be one of the following: {sorted(COMMODITY_REGIONS)}")
+            from assets.commodities import SORTED_COMMODITY_REGIONS
+            raise ValueError(f"region must be one of the following: {list(SORTED_COMMODITY_REGIONS)}")
 
         self.region = region
 
@@ -153,7 +166,8 @@ class Market(ApiBase):
         """
         class_ = str(class_).upper()
         if is_commodity_class(class_) is False:
-            raise ValueError(f"class_ must be one of the following: {sorted(COMMODITY_CLASSES)}")
+            from assets.commodities import SORTED_COMMODITY_CLASSES
+            raise ValueError(f"class_ must be one of the following: {list(SORTED_COMMODITY_CLASSES)}")
         self.class_ = class_
 
     def set_organic(self, organic: Union[str, bool]) -> None:
@@ -227,13 +241,47 @@ class Market(ApiBase):
         Refreshes the data for the given market and stores it in the data attribute as a pandas dataframe
         """
         _url = self.create_api_url()
-        _payload = self.create_payload(commodity=self.commodity, region=self.region, class_=self.class_,
-                                       organic=self.organic, begin_date=self.begin_date, end_date=self.end_date)
-        self.data = self.get_data(_url, _payload)
-        self.data = pd.DataFrame(self.data)
+        chunks = map_ordered(lambda payload: self.get_data(_url, payload), self.payloads(), self.workers)
+        # the windows do not overlap, so rows are never dropped: identical rows are legitimate market data
+        self.set_data(merge_rows(chunks, dedupe=False))
+
+    def payloads(self) -> List[dict]:
+        """
+        Creates the payloads of the market, one for the whole date range or one per window if window_days is set
+        :return: The payloads in chronological order
+        """
+        if self.window_days is None:
+            windows = [(self.begin_date, self.end_date)]
+        else:
+            windows = split_date_range(self.begin_date, self.end_date, self.window_days)
+        return [self.create_payload(commodity=self.commodity, region=self.region, class_=self.class_,
+                                    organic=self.organic, begin_date=begin_date, end_date=end_date)
+                for begin_date, end_date in windows]
+
+    def set_data(self, data) -> None:
+        """
+        Stores result rows of the market in the data attribute as a pandas dataframe, with optimized dtypes if
+        optimize_dtypes is set
+        :param data: The result rows, as a list of dicts or a dataframe
+        :return: None
+        """
+        import pandas as pd
+
+        def build():
+            _frame = data if isinstance(data, pd.DataFrame) else pd.DataFrame(data)
+            if not self.optimize_dtypes:
+                return _frame
+            from MyMarketNewsUSDA.Dtypes import memory_report, optimize_frame
+            _optimized = optimize_frame(_frame)
+            self.memory_report = memory_report(_frame, _optimized)
+            return _optimized
+
+        self.data = self.build_frame(build, str(self.commodity))
 
 
 if __name__ == "__main__":
+    import pandas as pd
+
     pd.set_option('display.max_columns', None)
     a = Market(commodity="LETTUCE, GREEN LEAF", region="National", class_="All", organic="No", begin_date="07/01/2021")
     a.refresh_data()
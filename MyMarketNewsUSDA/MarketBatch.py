@@ -0,0 +1,164 @@
+"""
+Author: Jacob Dallas
+
+Batched Market queries. Markets that only differ by commodity are requested together by one POST whose COMD is the
+list of their commodities, the POSTs are sent concurrently and the combined rows are split back out to every market by
+their commodity column.
+"""
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Dict, Iterable, List, Tuple, Union
+
+from MyMarketNewsUSDA.ApiBase import ApiBase
+from MyMarketNewsUSDA.Market import Market
+from MyMarketNewsUSDA.Sharding import DEFAULT_WORKERS, map_ordered, merge_rows, split_date_range
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+    from MyMarketNewsUSDA.Cache import ResponseCache
+    from MyMarketNewsUSDA.RateLimit import RateLimiter, RetryPolicy
+    from MyMarketNewsUSDA.Transport import Transport
+
+DEFAULT_MAX_COMMODITIES = 25
+ALL_COMMODITIES = "ALL"
+
+
+class MarketBatch(ApiBase):
+    """
+    Refreshes many markets with as few requests as possible. Markets sharing region, class, organic, date range,
+    window_days and the settings they send requests with (transport, API key, cache, rate limiter and retry policy)
+    are requested together, so 80 commodities across 10 regions take 10 requests instead of 800
+
+    :param markets: The markets to refresh, as Market instances or dicts of Market keyword arguments
+    :param workers: The maximum number of requests sent concurrently
+    :param max_commodities: The maximum number of commodities requested by a single POST
+    :param commodity_column: The column of the result rows holding their commodity, used to split the rows of a
+        combined request back out to its markets
+    :param transport: The Transport to send requests through, defaults to the shared transport
+    :param cache: An optional ResponseCache consulted before every request
+    :param rate_limiter: The per host RateLimiter requests wait on, defaults to the shared limiter
+    :param retry_policy: The RetryPolicy of throttled, failed or unreachable requests
+
+    :return: None
+        To refresh every market run method 'refresh_data', the data of each market is then in its 'data' property
+    """
+
+    def __init__(self, markets: Iterable[Union[Market, dict]] = (), workers: int = DEFAULT_WORKERS,
+                 max_commodities: int = DEFAULT_MAX_COMMODITIES, commodity_column: str = "commodity",
+                 transport: Transport = None, cache: ResponseCache = None, rate_limiter: RateLimiter = None,
+                 retry_policy: RetryPolicy = None):
+        super().__init__(api_type="market", transport=transport, cache=cache, rate_limiter=rate_limiter,
+                         retry_policy=retry_policy)
+        if max_commodities < 1:
+            raise ValueError(f"max_commodities must be at least 1, not {max_commodities}")
+        self.workers = workers
+        self.max_commodities = max_commodities
+        self.commodity_column = commodity_column
+        self.markets: List[Market] = []
+        for market in markets:
+            self.add(market)
+
+    def add(self, market: Union[Market, dict]) -> Market:
+        """
+        Adds a market to the batch
+        :param market: A Market, or a dict of Market keyword arguments. Markets created from a dict share the
+            transport, cache, rate limiter and retry policy of the batch
+        :return: The added market
+        """
+        if isinstance(market, dict):
+            market = Market(**{"transport": self._transport, "cache": self.cache, "rate_limiter": self.rate_limiter,
+                               "retry_policy": self.retry_policy, **market})
+        elif not isinstance(market, Market):
+            raise TypeError(f"market must be a Market or a dict of Market keyword arguments, not {type(market)}")
+        self.markets.append(market)
+        return market
+
+    def groups(self) -> List[Tuple[List[dict], List[Market]]]:
+        """
+        Groups the markets into the smallest set of requests. Only markets sharing their window_days, transport, API
+        key, cache, rate limiter and retry policy are combined, a windowed group is requested window by window like
+        Market.refresh_data does
+        :return: A list of (the payloads of a request in chronological order, markets answered by the payloads)
+        """
+        shared: Dict[tuple, Dict[str, List[Market]]] = {}
+        for market in self.markets:
+            key = (market.region, market.class_, market.organic, market.begin_date, market.end_date,
+                   market.window_days, market._transport, market.api_key, market.cache, market.rate_limiter,
+                   market.retry_policy)
+            shared.setdefault(key, {}).setdefault(market.commodity, []).append(market)
+
+        groups = []
+        for (region, class_, organic, begin_date, end_date, window_days, *_), by_commodity in shared.items():
+            windows = [(begin_date, end_date)] if window_days is None else \
+                split_date_range(begin_date, end_date, window_days)
+            # "ALL" already returns every commodity, it is never combined with others
+            chunks = [[x] for x in by_commodity if x == ALL_COMMODITIES]
+            commodities = sorted(x for x in by_commodity if x != ALL_COMMODITIES)
+            chunks += [commodities[x:x + self.max_commodities]
+                       for x in range(0, len(commodities), self.max_commodities)]
+            for chunk in chunks:
+                # a single commodity is sent exactly like Market sends it, so both share cached responses
+                payloads = [self.create_payload(commodity=chunk if len(chunk) > 1 else chunk[0], region=region,
+                                                class_=class_, organic=organic, begin_date=window_begin,
+                                                end_date=window_end)
+                            for window_begin, window_end in windows]
+                groups.append((payloads, [x for commodity in chunk for x in by_commodity[commodity]]))
+        return groups
+
+    def split(self, rows: list, commodities: List[str]) -> Dict[str, pd.DataFrame]:
+        """
+        Splits the combined result rows of a request by commodity
+        :param rows: The result rows
+        :param commodities: The upper cased commodities requested
+        :return: A dict of commodity to its rows as a dataframe, None if the rows could not be split, which is also the
+            case when their commodities do not match the requested ones exactly
+        """
+        import pandas as pd
+
+        frame = pd.DataFrame(rows)
+        if len(commodities) == 1:
+            return {commodities[0]: frame}
+        if frame.empty:
+            return {x: frame for x in commodities}
+        if self.commodity_column not in frame.columns:
+            return None
+        keys = frame[self.commodity_column].astype(str).str.upper().to_numpy()
+        positions = frame.groupby(keys).indices
+        # a commodity labelled differently by the server would lose its rows, it is then requested on its own
+        if set(positions) != set(commodities):
+            return None
+        return {x: frame.iloc[positions[x]].reset_index(drop=True) for x in commodities}
+
+    def refresh_data(self) -> List[Market]:
+        """
+        Refreshes the data of every market in the batch, the requests are sent concurrently
+        :return: The markets of the batch
+        """
+        _url = self.create_api_url()
+        groups = self.groups()
+        # every request goes through the first market of its group, whose request settings the group shares
+        requests = [(markets[0], payload) for payloads, markets in groups for payload in payloads]
+        results = iter(map_ordered(lambda market, payload: market.get_data(_url, payload) or [], requests,
+                                   self.workers))
+        unsplit = []
+        for payloads, markets in groups:
+            # the windows do not overlap, identical rows are legitimate market data
+            rows = merge_rows([next(results) for _ in payloads], dedupe=False)
+            commodities = list(dict.fromkeys(x.commodity for x in markets))
+            frames = self.split(rows, commodities)
+            if frames is None:
+                unsplit.extend(markets)
+                continue
+            for market in markets:
+                market.set_data(frames[market.commodity])
+        if unsplit:
+            # the rows could not be matched to their commodities, each commodity is requested on its own instead
+            map_ordered(lambda market: market.refresh_data(), unsplit, self.workers)
+        return self.markets
+
+    def __len__(self):
+        return len(self.markets)
+
+    def __repr__(self):
+        return f"MarketBatch(markets={len(self.markets)})"
@@ -4,19 +4,63 @@ Author: Jacob Dallas
 Anyone who says bureaucracy moves slow has never had to use the MMN API, they change something every 
 week that breaks this package. 
 """
+from __future__ import annotations
+
 import datetime
-import pandas as pd
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
-from constants import REPORT_API_BASE_URL
 from MyMarketNewsUSDA.ApiBase import ApiBase
+from MyMarketNewsUSDA.RateLimit import RateLimiter, RetryPolicy
+from MyMarketNewsUSDA.Sharding import DEFAULT_WORKERS, map_ordered
+from MyMarketNewsUSDA.Streaming import DEFAULT_BATCH_SIZE
 
+# pandas and the catalog are imported where they are first used, so that importing the module stays cheap
+if TYPE_CHECKING:
+    import pandas as pd
+
+    from MyMarketNewsUSDA.Cache import ResponseCache
+    from MyMarketNewsUSDA.Catalog import CatalogCache, ReportIndex
+    from MyMarketNewsUSDA.Transport import Transport
 
-class MyMarketNews(ApiBase):
 
-    def __init__(self, api_key: str = None):
-        super().__init__(api_key)
+class MyMarketNews(ApiBase):
+    """
+    :param api_key: The MyMarketNews API key
+    :param transport: The Transport to send requests through, defaults to the shared transport
+    :param cache: An optional ResponseCache consulted before every request
+    :param catalog: The CatalogCache holding the report listing, defaults to the cache shared by every instance
+    :param rate_limiter: The per host RateLimiter requests wait on, defaults to the shared limiter
+    :param retry_policy: The RetryPolicy of throttled, failed or unreachable requests
+    :param optimize_dtypes: If True the instance keeps a copy of the shared report listing with categorical and
+        downcast numeric columns, the memory saved is stored in the memory_report attribute
+    """
+
+    def __init__(self, api_key: str = None, transport: Transport = None, cache: ResponseCache = None,
+                 catalog: CatalogCache = None, rate_limiter: RateLimiter = None, retry_policy: RetryPolicy = None,
+                 optimize_dtypes: bool = False):
+        super().__init__(api_key, transport=transport, cache=cache, rate_limiter=rate_limiter,
+                         retry_policy=retry_policy)
+        self.optimize_dtypes = optimize_dtypes
+        self.memory_report = None
+        self._catalog = catalog
         self._current_reports = None
-        self._time_series_columns = ["report_date", "published_date"]
+        self._report_index = None
+        self._optimized_reports = (None, None)
+        self.fetch_errors = {}
+
+    @property
+    def catalog(self) -> CatalogCache:
+        """
+        The CatalogCache holding the report listing
+        """
+        if self._catalog is None:
+            from MyMarketNewsUSDA.Catalog import get_shared_catalog
+            return get_shared_catalog()
+        return self._catalog
+
+    @catalog.setter
+    def catalog(self, catalog: CatalogCache) -> None:
+        self._catalog = catalog
 
     def slug_check(self, slug_id: str) -> bool:
         """
@@ -29,7 +73,7 @@ class MyMarketNews(ApiBase):
         if not isinstance(slug_id, str):
             raise TypeError(f"slug_id must be a string")
 
-        _url: str = REPORT_API_BASE_URL + slug_id
+        _url: str = self.report_base_url + slug_id
         if self.get_data(_url) is None:
             return False
         return True
@@ -40,7 +84,8 @@ class MyMarketNews(ApiBase):
         returns if the desired date exists or not for the report being fetched
 
         :param search_type: The type of search to be performed, can be "exact", "before", or "after"
-        :param refresh_reports: If True, the reports will be refreshed before checking the date
+        :param refresh_reports: If True, the reports are re-read from the catalog cache, which downloads them again
+            once they are older than the catalog TTL
         :param slug_id: The ID of the report being fetched
         :param desired_date: The date of the report being fetched
 
@@ -49,23 +94,7 @@ class MyMarketNews(ApiBase):
         if (not isinstance(slug_id, str)) or (not isinstance(desired_date, datetime.date)):
             raise TypeError(f"Make sure both {slug_id} is of type string and {desired_date} is of type datetime.date")
 
-        if self._current_reports is None or refresh_reports:
-            _data = self.get_current_reports()
-        else:
-            _data = self._current_reports
-
-        # check if the slug_id is valid
-        if slug_id not in _data["slug_id"].values:
-            return False
-        _data_point = _data[_data["slug_id"] == slug_id]
-        if search_type == "exact":
-            _data_point = _data_point[_data_point["report_date"] == desired_date]
-        elif search_type == "before":
-            _data_point = _data_point[_data_point["report_date"] >= desired_date]
-        elif search_type == "after":
-            _data_point = _data_point[_data_point["report_date"] <= desired_date]
-
-        return len(_data_point) > 0
+        return self.get_report_index(refresh_reports).has_date(slug_id, desired_date, search_type)
 
     def get_report_info(self, slud_id: str, column_names: list = None) -> dict:
         """
@@ -75,20 +104,41 @@ class MyMarketNews(ApiBase):
         if not isinstance(slud_id, str):
             raise TypeError(f"slug_id must be a string")
 
-        if self._current_reports is None:
-            self.get_current_reports()
+        return self.describe_report(self.get_report_index(), slud_id, column_names)
 
-        # filter the dataframe to only include the report we want based on the slug_id
-        _report = self._current_reports[self._current_reports["slug_id"] == slud_id]
+    @staticmethod
+    def describe_report(_index: ReportIndex, slug_id: str, column_names: list = None) -> dict:
+        """
+        return a description of a given report from the index of the current reports, see get_report_info
+        """
         if column_names is None:
-            return _report.to_dict()
+            return _index.rows(slug_id).to_dict()
         output = {}
         for key in column_names:
-            if key not in _report.columns:
-                raise ValueError(f"{key} is not a valid column name of names: {list(_report.columns)}")
-            output[key] = _report[key].values[0]
+            if key not in _index.columns:
+                raise ValueError(f"{key} is not a valid column name of names: {list(_index.frame.columns)}")
+            output[key] = _index.value(slug_id, key)
         return output
 
+    def get_report_index(self, refresh_reports: bool = False) -> ReportIndex:
+        """
+        returns the index of the current reports, keyed by slug id, loading the reports first if needed
+
+        :param refresh_reports: If True, the reports are re-read from the catalog cache first
+        :return: the index of the current reports
+        """
+        if self._current_reports is None or refresh_reports:
+            self.get_current_reports()
+        return self.index_current_reports()
+
+    def index_current_reports(self) -> ReportIndex:
+        """
+        returns the index of the already loaded current reports, built once per catalog download
+        """
+        if self._report_index is None or self._report_index.frame is not self._current_reports:
+            self._report_index = self.catalog.index(self.catalog_key(), self._current_reports)
+        return self._report_index
+
     def get_report_title(self, slug_id: str) -> str:
         """
         return the title of a given report, if the slug id is not valid, this will return None
@@ -116,19 +166,150 @@ class MyMarketNews(ApiBase):
         """
         return self.get_report_info(slug_id, ["slug_id"]).get("slug_id", None)
 
-    def get_current_reports(self) -> pd.DataFrame:
+    def catalog_key(self) -> tuple:
         """
-        :return: returns every current report as a dataframe
+        :return: the key of the report listing in the catalog cache, instances only share a listing when they
+            download it through the same transport with the same API key, see ApiBase.flight_key
         """
-        data = self.get_data(REPORT_API_BASE_URL)
-        self._current_reports = pd.DataFrame(data)
+        return self.report_base_url, self.transport, self.api_key
 
-        # convert the time series columns to a datetime objects
-        for key in self._time_series_columns:
-            self._current_reports[key] = pd.to_datetime(self._current_reports[key])
+    def get_current_reports(self, force: bool = False) -> pd.DataFrame:
+        """
+        The listing is shared by every instance using the same catalog cache, transport and API key. Once it is older
+        than the catalog TTL it is revalidated, and only downloaded and parsed again if it changed, see
+        fetch_current_reports. The returned dataframe is shared and should be treated as read only
 
+        :param force: If True the listing is revalidated even if the cached one is still fresh
+        :return: returns every current report as a dataframe
+        """
+        self._current_reports = self.optimize_current_reports(
+            self.catalog.get_conditional(self.catalog_key(), self.fetch_current_reports, force=force))
         return self._current_reports
 
+    def optimize_current_reports(self, reports: pd.DataFrame) -> pd.DataFrame:
+        """
+        The shared listing is never optimized in place, other instances may not have optimize_dtypes set. An instance
+        that has keeps an optimized copy of its own, made again whenever the shared listing changes
+
+        :param reports: The shared report listing
+        :return: the listing this instance works on
+        """
+        if not self.optimize_dtypes:
+            return reports
+        source, optimized = self._optimized_reports
+        if source is not reports:
+            from MyMarketNewsUSDA.Dtypes import memory_report, optimize_frame
+            optimized = self.build_frame(lambda: optimize_frame(reports), "catalog")
+            self.memory_report = memory_report(reports, optimized)
+            self._optimized_reports = (reports, optimized)
+        return optimized
+
+    def fetch_current_reports(self, reports: pd.DataFrame = None, validators: dict = None) -> Tuple[pd.DataFrame, dict]:
+        """
+        Downloads the report listing unless the cached listing is still current. If the server returned an ETag or
+        Last-Modified with the cached listing, a conditional request is sent and a 304 keeps the cached listing.
+        Otherwise the reports published since the newest published_date of the cached listing are requested, and
+        the listing is only downloaded again if there are any, or if the server rejects that request. Neither request
+        goes through the ResponseCache, which would answer them with a listing as old as its TTL
+
+        :param reports: The cached listing, None to download it
+        :param validators: The validators stored with the cached listing
+        :return: (None, validators) if the cached listing is current, otherwise (the listing, its validators)
+        """
+        import requests
+
+        validators = validators or {}
+        if reports is not None and not (validators.get("etag") or validators.get("last_modified")):
+            latest = self.latest_published(reports)
+            probe = None
+            if latest is not None:
+                try:
+                    probe = self.get_conditional(self.catalog_probe_url(latest))[0] or []
+                except requests.HTTPError:
+                    # the probe is only an optimisation, a server rejecting the filter gets the full download
+                    pass
+            if probe is not None:
+                if not self.published_since(probe, latest):
+                    return None, validators
+                # a server ignoring the filter answers the probe with the whole listing, which is then reused
+                if len(probe) >= len(reports):
+                    return self.build_current_reports(probe), {}
+            data, validators = self.get_conditional(self.report_base_url)
+        else:
+            data, validators = self.get_conditional(self.report_base_url, validators if reports is not None else None)
+            if data is None:
+                return None, validators
+        return self.build_current_reports(data), validators
+
+    @staticmethod
+    def published_since(probe: list, latest: datetime.datetime) -> bool:
+        """
+        :param probe: The rows returned by the catalog_probe_url of a cached listing
+        :param latest: The newest published_date of the cached listing
+        :return: whether any of the rows was published after it
+        """
+        import pandas as pd
+
+        from MyMarketNewsUSDA.Decoding import CATALOG_SCHEMA
+        published = CATALOG_SCHEMA.convert("published_date", [x.get("published_date") for x in probe]).max()
+        return bool(probe) and published is not pd.NaT and published.to_pydatetime() > latest
+
+    def catalog_probe_url(self, since: datetime.datetime) -> str:
+        """
+        :param since: The newest published_date of the cached listing
+        :return: the URL of the reports published on or after the day of since, used to revalidate the listing
+            when the server sends no validators
+        """
+        return self.report_base_url + f"?q=published_date={since:%m/%d/%Y}:{datetime.date.today():%m/%d/%Y}"
+
+    @staticmethod
+    def latest_published(reports: pd.DataFrame) -> Optional[datetime.datetime]:
+        """
+        :param reports: A report listing
+        :return: the newest published_date of the listing, None if it has none
+        """
+        if "published_date" not in reports.columns or reports.empty:
+            return None
+        latest = reports["published_date"].max()
+        return None if latest is None or latest != latest else latest.to_pydatetime()
+
+    def build_current_reports(self, data: list) -> pd.DataFrame:
+        """
+        Builds the current reports dataframe from the raw report listing
+
+        :param data: The result rows of the report listing
+        :return: the report listing as a dataframe
+        """
+        from MyMarketNewsUSDA.Decoding import CATALOG_SCHEMA
+
+        # the time series columns are parsed to datetime objects while the frame is built
+        return self.build_frame(lambda: CATALOG_SCHEMA.frame(data), "catalog")
+
+    def iter_pages(self, slug_id: str, begin_date=None, end_date=None, window_days: int = None,
+                   batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[List[dict]]:
+        """
+        Streams a report in batches of rows, memory use is bounded by the batch size
+
+        :param slug_id: The ID of the report being fetched
+        :param begin_date: The first report date to fetch
+        :param end_date: The last report date to fetch, defaults to today when begin_date is given
+        :param window_days: If given, the date range is requested in windows of this many days
+        :param batch_size: The maximum number of rows per batch
+        :return: An iterator over lists of result rows
+        """
+        return self.iter_report_data(slug_id, begin_date=begin_date, end_date=end_date, window_days=window_days,
+                                     batch_size=batch_size)
+
+    def iter_rows(self, slug_id: str, begin_date=None, end_date=None, window_days: int = None,
+                  batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[dict]:
+        """
+        Streams a report row by row, see iter_pages
+
+        :return: An iterator over the result rows
+        """
+        for batch in self.iter_pages(slug_id, begin_date, end_date, window_days, batch_size):
+            yield from batch
+
     def single_date(self, slug_id: str, begin_date, key):
         """
         Function can be called to get a single data point from a single report
@@ -138,7 +319,7 @@ class MyMarketNews(ApiBase):
         :param key:
         :return:
         """
-        _url = REPORT_API_BASE_URL + slug_id + "?q=report_begin_date=" + begin_date
+        _url = self.report_base_url + slug_id + "?q=report_begin_date=" + begin_date
         _data = self.get_data(_url)
 
         x = _data["results"]
@@ -146,32 +327,105 @@ class MyMarketNews(ApiBase):
         for i in range(len(x)):
             print(x[i][key])
 
-    def time_series(self, slug_id):
+    def time_series(self, slug_id: str, values=None, begin_date=None, end_date=None, by="commodity",
+                    date_column: str = "report_date", freq: str = None, agg: str = "mean", layout: str = "wide",
+                    ffill: bool = False, window_days: int = None, workers: int = DEFAULT_WORKERS) -> pd.DataFrame:
         """
-        need to convert the data into a df that can split the data relative to the commodity
-        don't know if I can make it generalized or if I need to make it specific to the report
+        Gets a report as date indexed time series per commodity and metric, see TimeSeries.time_series
+
+        :param slug_id: The ID of the report being fetched
+        :param values: The metric column(s), if None every column holding only numbers is used
+        :param begin_date: The first report date to fetch
+        :param end_date: The last report date to fetch, defaults to today when begin_date is given
+        :param by: The column(s) splitting the series, None for a single series per metric
+        :param date_column: The column the series are indexed by
+        :param freq: A pandas offset alias the series are resampled to, e.g. "W" or "MS"
+        :param agg: How values sharing a date or resampling period are combined
+        :param layout: "wide" for (metric, commodity) columns, "long" for date, commodity, metric and value columns
+        :param ffill: If True missing dates of a wide series are filled with the last known value
+        :param window_days: If given, the date range is requested in windows of this many days
+        :param workers: The maximum number of windows fetched concurrently
+        :return: The time series as a dataframe
         """
+        from MyMarketNewsUSDA.TimeSeries import time_series
 
-        _url = REPORT_API_BASE_URL + slug_id
-        _data = self.get_data(_url)
-        print(f"Data for {slug_id} has been fetched")
-        print(f"{_data=}")
-        # Butter = []
-        # Date_Butter = []
-        # Cheese = []
-        # Date_Cheese = []
-        #
-        # x = data["results"]
-        #
-        # for i in range(len(x)):
-        #     if x[i]["commodity"] == "Butter":
-        #         Butter.append(x[i]["holdings_current_lbs"])
-        #         Date_Butter.append(x[i]["published_date"])
-        #     else:
-        #         Cheese.append(x[i]["holdings_current_lbs"])
-        #         Date_Cheese.append(x[i]["published_date"])
-        #
-        # print(Butter)
+        frame = self.get_report_frame(slug_id, begin_date=begin_date, end_date=end_date, window_days=window_days,
+                                      workers=workers)
+        return time_series(frame, values=values, date_column=date_column, by=by, freq=freq, agg=agg, layout=layout,
+                           ffill=ffill)
+
+    def fetch_many(self, slug_ids: Iterable[str], begin_date=None, end_date=None, workers: int = DEFAULT_WORKERS,
+                   window_days: int = None, join: bool = False, values=None, by="commodity",
+                   date_column: str = "report_date", agg: str = "mean") -> Union[Dict[str, pd.DataFrame], pd.DataFrame]:
+        """
+        Fetches many reports concurrently. A report that fails does not abort the others, its exception is stored in
+        the fetch_errors attribute under its slug id and it is left out of the result
+
+        :param slug_ids: The IDs of the reports being fetched
+        :param begin_date: The first report date to fetch
+        :param end_date: The last report date to fetch, defaults to today when begin_date is given
+        :param workers: The maximum number of requests sent concurrently
+        :param window_days: If given, the date range of every report is requested in windows of this many days
+        :param join: If True the reports are returned as one frame indexed by date, outer joined so that every date of
+            any report is kept, with (slug_id, metric, commodity) columns, see time_series for values, by and agg
+        :param values: The metric column(s) of the joined frame, if None every column holding only numbers is used
+        :param by: The column(s) splitting the series of every report in the joined frame, None for one per metric
+        :param date_column: The column the joined frame is aligned on
+        :param agg: How values of a report sharing a date are combined in the joined frame
+        :return: a dict mapping every fetched slug id to its report data as a dataframe, or the joined frame
+        """
+        slug_ids = list(dict.fromkeys(str(x) for x in slug_ids))
+        # the windows of every report share the worker budget, so that at most workers requests are in flight
+        window_workers = max(1, workers // max(1, len(slug_ids)))
+
+        def fetch(slug_id: str):
+            try:
+                return self.get_report_frame(slug_id, begin_date=begin_date, end_date=end_date,
+                                             window_days=window_days, workers=window_workers), None
+            except Exception as e:
+                return None, e
+
+        results = map_ordered(fetch, slug_ids, workers)
+        self.fetch_errors = {x: error for x, (_, error) in zip(slug_ids, results) if error is not None}
+        frames = {x: frame for x, (frame, error) in zip(slug_ids, results) if error is None}
+        if not join:
+            return frames
+        return self.join_reports(frames, values=values, by=by, date_column=date_column, agg=agg)
+
+    @staticmethod
+    def join_reports(frames: Dict[str, pd.DataFrame], values=None, by="commodity", date_column: str = "report_date",
+                     agg: str = "mean") -> pd.DataFrame:
+        """
+        Aligns the data of many reports on their dates
+
+        :param frames: A dict mapping slug ids to report data, as returned by fetch_many
+        :param values: The metric column(s), if None every column holding only numbers is used
+        :param by: The column(s) splitting the series of every report, reports missing one of them are not split by it
+        :param date_column: The column the reports are aligned on
+        :param agg: How values of a report sharing a date are combined
+        :return: one frame indexed by date, outer joined over every report, with (slug_id, metric, *by) columns
+        """
+        import pandas as pd
+
+        from MyMarketNewsUSDA.TimeSeries import time_series
+
+        by = [] if by is None else [by] if isinstance(by, str) else list(by)
+        series = {}
+        for slug_id, frame in frames.items():
+            if frame.empty or date_column not in frame.columns:
+                continue
+            if values is None:
+                _values = None
+            else:
+                _values = [x for x in ([values] if isinstance(values, str) else values) if x in frame.columns]
+                if not _values:
+                    continue
+            # a blank level for the missing columns keeps the columns of every report at the same depth
+            frame = frame.assign(**{x: "" for x in by if x not in frame.columns})
+            series[slug_id] = time_series(frame, values=_values, date_column=date_column, by=by, agg=agg)
+        if not series:
+            return pd.DataFrame(index=pd.DatetimeIndex([], name=date_column))
+        return pd.concat(series, axis=1, join="outer", names=["slug_id"]).sort_index()
 
     def get_market_data(self):
         """
@@ -0,0 +1,210 @@
+"""
+Author: Jacob Dallas
+
+Client side rate limiting and retries. Every host gets one token bucket shared by all clients in the process. The
+bucket adapts to the server: its rate is cut when the server throttles and slowly raised again while requests succeed,
+so the request rate settles just under the server's limit instead of oscillating around it.
+"""
+import datetime
+import random
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+DEFAULT_RATE = 20.0
+DEFAULT_BURST = 20
+DEFAULT_MIN_RATE = 0.5
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF_BASE = 0.5
+DEFAULT_BACKOFF_MAX = 60.0
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+THROTTLE_STATUSES = frozenset({429, 503})
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parses a Retry-After header
+    :param value: The header value, either a number of seconds or an HTTP date
+    :return: The number of seconds to wait, or None if the header is missing or malformed
+    """
+    if value is None:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    import email.utils
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket with an additive increase / multiplicative decrease rate
+
+    :param rate: The initial and maximum number of requests per second
+    :param burst: The number of requests that may be sent at once after an idle period
+    :param min_rate: The rate is never cut below this
+    :param decrease_factor: The rate is multiplied by this when the server throttles
+    :param increase_step: The rate is raised by this after every successful request, defaults to 1% of rate
+    """
+    def __init__(self, rate: float = DEFAULT_RATE, burst: int = DEFAULT_BURST, min_rate: float = DEFAULT_MIN_RATE,
+                 decrease_factor: float = 0.5, increase_step: float = None):
+        if rate <= 0 or burst < 1:
+            raise ValueError(f"rate must be positive and burst at least 1, not {rate} and {burst}")
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min(min_rate, rate)
+        self.decrease_factor = decrease_factor
+        self.increase_step = rate / 100 if increase_step is None else increase_step
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Takes a token, going into debt if none is available
+        :return: The number of seconds to wait before the request may be sent
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= 1
+            wait = 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+            return max(wait, self._blocked_until - now)
+
+    def acquire(self) -> None:
+        """
+        Blocks until a request may be sent
+        """
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def on_success(self) -> None:
+        """
+        Raises the rate after a successful request
+        """
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+    def on_throttle(self, retry_after: float = None) -> None:
+        """
+        Cuts the rate after the server throttled a request, and pauses the bucket for retry_after seconds
+        """
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            self._tokens = min(self._tokens, 0.0)
+            if retry_after:
+                self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+
+    def __repr__(self):
+        return f"TokenBucket(rate={self.rate:.2f}, max_rate={self.max_rate}, burst={self.burst})"
+
+
+class RateLimiter:
+    """
+    Registry of token buckets, one per host
+
+    :param rate: The requests per second allowed for a host without an explicit limit
+    :param burst: The burst allowed for a host without an explicit limit
+    """
+    def __init__(self, rate: float = DEFAULT_RATE, burst: int = DEFAULT_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def set_limit(self, host: str, rate: float, burst: int = None) -> TokenBucket:
+        """
+        Sets the limit of a host
+        :param host: The host name, e.g. "marsapi.ams.usda.gov"
+        :param rate: The requests per second
+        :param burst: The burst size, defaults to the registry default
+        :return: The bucket of the host
+        """
+        with self._lock:
+            bucket = self._buckets[host.lower()] = TokenBucket(rate, self.burst if burst is None else burst)
+            return bucket
+
+    def bucket(self, _url: str) -> TokenBucket:
+        """
+        :param _url: A URL of the host
+        :return: the bucket shared by every request to the host of the URL
+        """
+        host = urlsplit(_url).netloc.lower()
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = self._buckets[host] = TokenBucket(self.rate, self.burst)
+            return bucket
+
+
+class RetryPolicy:
+    """
+    Retries with jittered exponential backoff
+
+    :param max_retries: The maximum number of retries after the first attempt
+    :param backoff_base: The backoff of the first retry in seconds, doubled on every further retry
+    :param backoff_max: The backoff is never longer than this, unless the server asks for more with Retry-After
+    :param retry_statuses: The HTTP statuses that are retried
+    """
+    def __init__(self, max_retries: int = DEFAULT_MAX_RETRIES, backoff_base: float = DEFAULT_BACKOFF_BASE,
+                 backoff_max: float = DEFAULT_BACKOFF_MAX, retry_statuses=RETRY_STATUSES):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_statuses = frozenset(retry_statuses)
+
+    def _settings(self) -> tuple:
+        return self.max_retries, self.backoff_base, self.backoff_max, self.retry_statuses
+
+    def __eq__(self, other):
+        if not isinstance(other, RetryPolicy):
+            return NotImplemented
+        return self._settings() == other._settings()
+
+    def __hash__(self):
+        return hash(self._settings())
+
+    def should_retry(self, attempt: int, status_code: int = None) -> bool:
+        """
+        :param attempt: The number of the failed attempt, starting at 0
+        :param status_code: The HTTP status of the failed attempt, None for a connection error
+        :return: whether the request should be sent again
+        """
+        if attempt >= self.max_retries:
+            return False
+        return status_code is None or status_code in self.retry_statuses
+
+    def backoff(self, attempt: int, retry_after: float = None) -> float:
+        """
+        :param attempt: The number of the failed attempt, starting at 0
+        :param retry_after: The delay requested by the server, if any
+        :return: the number of seconds to wait before the next attempt ("full jitter" backoff)
+        """
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+
+_default_rate_limiter = RateLimiter()
+
+
+def get_default_rate_limiter() -> RateLimiter:
+    """
+    Returns the process wide rate limiter used by every ApiBase instance that was not given its own
+    :return: The shared RateLimiter
+    """
+    return _default_rate_limiter
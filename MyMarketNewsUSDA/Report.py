@@ -1,32 +1,173 @@
 """
 Author: Jacob Dallas
 """
+from __future__ import annotations
+
+import datetime
+import time
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Union
+
 from MyMarketNewsUSDA.ApiBase import ApiBase
+from MyMarketNewsUSDA.Sharding import DEFAULT_WORKERS, map_ordered, to_date
+from MyMarketNewsUSDA.Streaming import DEFAULT_BATCH_SIZE
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+    from MyMarketNewsUSDA.Decoding import ReportSchema
+    from MyMarketNewsUSDA.Store import ReportStore
 
 
 class Report(ApiBase):
     """
     This class is used to store the data from a single report and provide methods to manipulate that data
+    Creating a report does not send any request, the data is gathered on first access of 'data' or by 'load'
+
+    :param slug_id: The slug_id of the report
+    :param begin_date: The first report date to fetch, if None the API default range is fetched
+    :param end_date: The last report date to fetch, defaults to today when begin_date is given
+    :param window_days: If given, the date range is split into windows of this many days fetched concurrently
+    :param workers: The maximum number of windows fetched concurrently
+    :param transport: The Transport to send requests through, defaults to the shared transport
+    :param cache: An optional ResponseCache consulted before every request
+    :param rate_limiter: The per host RateLimiter requests wait on, defaults to the shared limiter
+    :param retry_policy: The RetryPolicy of throttled, failed or unreachable requests
     """
     def __init__(self, **kwargs):
-        super().__init__(kwargs.get("api_key", None))
+        super().__init__(kwargs.get("api_key", None), transport=kwargs.get("transport", None),
+                         cache=kwargs.get("cache", None), rate_limiter=kwargs.get("rate_limiter", None),
+                         retry_policy=kwargs.get("retry_policy", None))
         self.slug_id = kwargs.get("slug_id", None)
-        if self.slug_id is None:
-            self.data = None
-
-        # get the report data
+        self.begin_date = kwargs.get("begin_date", None)
+        self.end_date = kwargs.get("end_date", None)
+        self.window_days = kwargs.get("window_days", None)
+        self.workers = kwargs.get("workers", DEFAULT_WORKERS)
         self.report_url = self.create_api_url(slug_id=self.slug_id)
-        self.data = self.get_data(self.report_url)
+        self.loaded_at = None
+        self._data = None
+
+    @property
+    def data(self) -> list:
+        """
+        The report data, gathered on first access
+        """
+        if self.loaded_at is None:
+            self.load()
+        return self._data
+
+    @data.setter
+    def data(self, data: list) -> None:
+        self._data = data
+        self.loaded_at = time.monotonic()
+
+    @property
+    def is_loaded(self) -> bool:
+        """
+        Whether the report data has been gathered
+        """
+        return self.loaded_at is not None
+
+    def to_frame(self, schema: ReportSchema = None, stream: bool = False,
+                 batch_size: int = DEFAULT_BATCH_SIZE) -> pd.DataFrame:
+        """
+        Returns the report data as a typed dataframe, loading it first if needed
+        :param schema: The ReportSchema used to parse the columns, defaults to the schema registered for the slug_id
+        :param stream: If True and the report is not loaded yet, it is streamed straight into the frame without
+            storing the rows in data, so that peak memory stays close to the size of the frame
+        :param batch_size: The number of rows decoded before they are moved into the frame when streaming
+        :return: The report data as a dataframe
+        """
+        from MyMarketNewsUSDA.Decoding import FrameBuffer, get_schema
+        schema = get_schema(self.slug_id) if schema is None else schema
+        if stream and not self.is_loaded:
+            return self.build_frame(lambda: FrameBuffer(schema).extend(self.iter_pages(batch_size)).frame(),
+                                    str(self.slug_id))
+        data = self.data or []
+        return self.build_frame(lambda: schema.frame(data), str(self.slug_id))
+
+    def fetch(self) -> list:
+        """
+        Gathers the data for the report over the configured date range, without storing it
+        :return: The report data
+        """
+        return self.get_report_data(self.slug_id, begin_date=self.begin_date, end_date=self.end_date,
+                                    window_days=self.window_days, workers=self.workers)
+
+    def load(self) -> list:
+        """
+        Gathers the data for the report and stores it in the data attribute
+        :return: The report data
+        """
+        self.data = self.fetch()
+        return self._data
+
+    def refresh(self, if_stale: Union[float, datetime.timedelta] = None) -> bool:
+        """
+        Gathers the data for the report again
+        :param if_stale: If given, the data is only gathered again if it was loaded longer ago than this many seconds
+            (or this timedelta), or was never loaded
+        :return: True if the data was gathered
+        """
+        if if_stale is not None and self.loaded_at is not None:
+            if isinstance(if_stale, datetime.timedelta):
+                if_stale = if_stale.total_seconds()
+            if time.monotonic() - self.loaded_at < if_stale:
+                return False
+        self.load()
+        return True
+
+    def iter_pages(self, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[List[dict]]:
+        """
+        Streams the report over the configured date range in batches of rows without storing it in data
+        :param batch_size: The maximum number of rows per batch
+        :return: An iterator over lists of result rows
+        """
+        return self.iter_report_data(self.slug_id, begin_date=self.begin_date, end_date=self.end_date,
+                                     window_days=self.window_days, batch_size=batch_size)
+
+    def iter_rows(self, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[dict]:
+        """
+        Streams the report over the configured date range row by row without storing it in data
+        :param batch_size: The number of rows decoded ahead of the consumer
+        :return: An iterator over the result rows
+        """
+        for batch in self.iter_pages(batch_size):
+            yield from batch
+
+    def sync(self, store: ReportStore, batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+        """
+        Brings the stored copy of the report up to date, only the report dates after the newest report_date already
+        stored are requested and the new rows are appended to the store batch by batch. The request filters on the
+        report dates, so published_date cannot mark how far the local copy reaches: a report is often published days
+        after its report date
+        :param store: The ReportStore holding the local copy of the report
+        :param batch_size: The maximum number of rows appended at once
+        :return: The number of appended rows
+        """
+        latest = store.latest_date(self.slug_id, "report_date")
+        begin_date = self.begin_date if latest is None else latest + datetime.timedelta(days=1)
+        end_date = self.end_date
+        if begin_date is not None:
+            if end_date is None:
+                end_date = datetime.date.today()
+            if to_date(begin_date) > to_date(end_date):
+                return 0
+        appended = 0
+        for batch in self.iter_report_data(self.slug_id, begin_date=begin_date, end_date=end_date,
+                                           window_days=self.window_days, batch_size=batch_size):
+            appended += store.append(self.slug_id, batch)
+        return appended
 
     def set_slug_id(self, slug_id: str) -> None:
         """
-        Sets the slug_id of the report, then gathers the data for that report
+        Sets the slug_id of the report, the data for that report is gathered on next access
         :param slug_id: The slug_id to be set
         :return: None
         """
         self.slug_id = slug_id
         self.report_url = self.create_api_url(slug_id=self.slug_id)
-        self.data = self.get_data(self.report_url)
+        self.loaded_at = None
+        self._data = None
 
     def __repr__(self):
         return f"Report(slug_id={self.slug_id})"
@@ -35,5 +176,13 @@ class Report(ApiBase):
         return f"Report(slug_id={self.slug_id})"
 
 
-
-
+def load_reports(reports: Iterable[Report], workers: int = DEFAULT_WORKERS) -> List[Report]:
+    """
+    Loads the data of many reports concurrently, reports that are already loaded are skipped
+    :param reports: The reports to load
+    :param workers: The maximum number of reports loaded at once
+    :return: The reports
+    """
+    reports = list(reports)
+    map_ordered(lambda x: x.load(), [x for x in reports if not x.is_loaded], workers)
+    return reports
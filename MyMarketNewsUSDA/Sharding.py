@@ -0,0 +1,109 @@
+"""
+Author: Jacob Dallas
+
+Helpers to split long date ranges into windows, fetch the windows concurrently and merge the results back in order.
+"""
+import datetime
+import hashlib
+import json
+from typing import Callable, Iterable, List, Tuple, TypeVar, Union
+
+DEFAULT_WORKERS = 4
+
+T = TypeVar("T")
+DateLike = Union[str, datetime.date, datetime.datetime]
+
+
+def to_date(value: DateLike) -> datetime.date:
+    """
+    Converts a date given as a MM/DD/YYYY string, datetime.date or datetime.datetime into a datetime.date
+    :param value: The date to convert
+    :return: The date as a datetime.date
+    """
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    if isinstance(value, str):
+        try:
+            return datetime.datetime.strptime(value, "%m/%d/%Y").date()
+        except ValueError:
+            raise ValueError(f"dates must be in the format MM/DD/YYYY, not {value}")
+    raise TypeError(f"dates must be of type str, datetime.date, or datetime.datetime, not {type(value)}")
+
+
+def split_date_range(begin_date: DateLike, end_date: DateLike,
+                     window_days: int) -> List[Tuple[datetime.date, datetime.date]]:
+    """
+    Splits the inclusive range begin_date - end_date into consecutive, non overlapping inclusive windows
+    :param begin_date: The first date of the range
+    :param end_date: The last date of the range
+    :param window_days: The number of days covered by each window
+    :return: The (begin, end) windows in chronological order
+    """
+    if window_days is None or window_days < 1:
+        raise ValueError(f"window_days must be at least 1, not {window_days}")
+    begin_date, end_date = to_date(begin_date), to_date(end_date)
+    if end_date < begin_date:
+        raise ValueError(f"end_date {end_date} is before begin_date {begin_date}")
+    windows = []
+    step = datetime.timedelta(days=window_days)
+    window_begin = begin_date
+    while window_begin <= end_date:
+        window_end = min(window_begin + step - datetime.timedelta(days=1), end_date)
+        windows.append((window_begin, window_end))
+        window_begin = window_end + datetime.timedelta(days=1)
+    return windows
+
+
+def map_ordered(fetch: Callable[..., T], items: Iterable, workers: int = DEFAULT_WORKERS) -> List[T]:
+    """
+    Calls fetch on every item through a thread pool and returns the results in the order of the items
+    :param fetch: The function to call, it is passed one item (tuples are unpacked into positional arguments)
+    :param items: The items to fetch
+    :param workers: The maximum number of concurrent calls
+    :return: The results in the order of the items, the first exception raised by any call is re-raised
+    """
+    items = list(items)
+    if workers is None or workers < 1:
+        raise ValueError(f"workers must be at least 1, not {workers}")
+    if len(items) <= 1 or workers == 1:
+        return [fetch(*x) if isinstance(x, tuple) else fetch(x) for x in items]
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=min(workers, len(items))) as executor:
+        futures = [executor.submit(fetch, *x) if isinstance(x, tuple) else executor.submit(fetch, x) for x in items]
+        return [x.result() for x in futures]
+
+
+def row_fingerprint(row: dict) -> bytes:
+    """
+    :param row: A result row
+    :return: a compact digest identifying the row, used to drop the rows returned by two consecutive windows
+    """
+    return hashlib.blake2b(json.dumps(row, sort_keys=True, default=str).encode(), digest_size=16).digest()
+
+
+def merge_rows(chunks: Iterable[list], dedupe: bool = True) -> list:
+    """
+    Concatenates the result rows of consecutive windows, dropping rows that were already returned by the previous
+    window, which happens when the API includes a row on both sides of a window edge
+    :param chunks: The result rows of every window in order
+    :param dedupe: If False, the rows are only concatenated
+    :return: The merged rows
+    """
+    merged = []
+    previous_keys = set()
+    for chunk in chunks:
+        if not chunk:
+            continue
+        if not dedupe:
+            merged.extend(chunk)
+            continue
+        keys = set()
+        for row in chunk:
+            key = json.dumps(row, sort_keys=True, default=str)
+            keys.add(key)
+            if key not in previous_keys:
+                merged.append(row)
+        previous_keys = keys
+    return merged
@@ -0,0 +1,121 @@
+"""
+Author: Jacob Dallas
+
+Coalescing of identical in-flight requests: while a request is running, every identical request waits for it and
+receives its result instead of sending a request of its own.
+"""
+from __future__ import annotations
+
+import threading
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+if TYPE_CHECKING:
+    import asyncio
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces identical calls made concurrently from several threads. The result is shared by every caller, treat it
+    as read only
+    """
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Calls fn, unless a call with the same key is already running in which case its result is awaited instead
+        :param key: Identifies identical calls
+        :param fn: The call
+        :return: The result of fn, exceptions raised by fn are raised for every caller
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+class AsyncSingleFlight:
+    """
+    Coalesces identical coroutine calls made concurrently on an event loop. The result is shared by every caller,
+    treat it as read only. The call runs in a task of its own, so a caller that is cancelled, the one that started the
+    call included, does not cancel it for the others
+    """
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._tasks: Dict[Tuple[int, Hashable], asyncio.Task] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Awaits fn(), unless a call with the same key is already running in which case its result is awaited instead
+        :param key: Identifies identical calls
+        :param fn: Creates the coroutine of the call
+        :return: The result of the call, exceptions raised by the call are raised for every caller
+        """
+        import asyncio
+        loop = asyncio.get_running_loop()
+        key = (id(loop), key)
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = loop.create_task(fn())
+            task.add_done_callback(lambda _task: self._finish(key, _task))
+            self.calls += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Tuple[int, Hashable], task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        # every caller may have been cancelled, mark the exception retrieved so that it is not logged as unhandled
+        if not task.cancelled():
+            task.exception()
+
+
+_default_single_flight = SingleFlight()
+_default_async_single_flight = AsyncSingleFlight()
+
+
+def get_default_single_flight() -> SingleFlight:
+    """
+    Returns the process wide SingleFlight shared by every ApiBase instance
+    :return: The shared SingleFlight
+    """
+    return _default_single_flight
+
+
+def get_default_async_single_flight() -> AsyncSingleFlight:
+    """
+    Returns the process wide AsyncSingleFlight shared by every async instance
+    :return: The shared AsyncSingleFlight
+    """
+    return _default_async_single_flight
@@ -0,0 +1,104 @@
+"""
+Author: Jacob Dallas
+
+Local stores that report data can be synced into, see Report.sync
+"""
+import abc
+import datetime
+import threading
+from typing import Dict, Optional, Tuple
+
+import pandas as pd
+
+
+def latest_row_date(rows, column: str) -> Optional[datetime.date]:
+    """
+    Finds the newest date of a column across result rows or a dataframe
+    :param rows: A list of result rows or a dataframe
+    :param column: The date column, e.g. "report_date" or "published_date"
+    :return: The newest date, or None if there is no parsable date
+    """
+    if isinstance(rows, pd.DataFrame):
+        if column not in rows.columns:
+            return None
+        values = rows[column]
+    else:
+        values = [x.get(column) for x in rows]
+    if len(values) == 0:
+        return None
+    latest = pd.to_datetime(pd.Series(values), format="%m/%d/%Y", errors="coerce").max()
+    if pd.isna(latest):
+        latest = pd.to_datetime(pd.Series(values), errors="coerce").max()
+    return None if pd.isna(latest) else latest.date()
+
+
+class ReportStore(abc.ABC):
+    """
+    Interface of a local copy of report data, one table of rows per slug_id
+    """
+
+    @abc.abstractmethod
+    def latest_date(self, slug_id: str, column: str = "report_date") -> Optional[datetime.date]:
+        """
+        :param slug_id: The ID of the report
+        :param column: The date column to look at, e.g. "report_date" or "published_date"
+        :return: the newest date stored for the report, or None if nothing is stored yet
+        """
+
+    @abc.abstractmethod
+    def append(self, slug_id: str, rows: list) -> int:
+        """
+        Appends result rows to the stored copy of a report
+        :param slug_id: The ID of the report
+        :param rows: The result rows to append
+        :return: The number of appended rows
+        """
+
+    @abc.abstractmethod
+    def read(self, slug_id: str) -> pd.DataFrame:
+        """
+        :param slug_id: The ID of the report
+        :return: the stored copy of the report
+        """
+
+
+class MemoryReportStore(ReportStore):
+    """
+    ReportStore keeping every report as an in-memory dataframe
+    """
+    def __init__(self):
+        self._frames: Dict[str, list] = {}
+        self._latest: Dict[Tuple[str, str], Optional[datetime.date]] = {}
+        self._lock = threading.Lock()
+
+    def latest_date(self, slug_id: str, column: str = "report_date") -> Optional[datetime.date]:
+        with self._lock:
+            if (slug_id, column) not in self._latest:
+                self._latest[(slug_id, column)] = latest_row_date(self._read(slug_id), column)
+            return self._latest[(slug_id, column)]
+
+    def append(self, slug_id: str, rows: list) -> int:
+        if not rows:
+            return 0
+        frame = pd.DataFrame(rows)
+        with self._lock:
+            self._frames.setdefault(slug_id, []).append(frame)
+            for (stored_slug_id, column), latest in list(self._latest.items()):
+                if stored_slug_id != slug_id:
+                    continue
+                new_latest = latest_row_date(frame, column)
+                if new_latest is not None and (latest is None or new_latest > latest):
+                    self._latest[(slug_id, column)] = new_latest
+        return len(frame)
+
+    def _read(self, slug_id: str) -> pd.DataFrame:
+        frames = self._frames.get(slug_id)
+        if not frames:
+            return pd.DataFrame()
+        if len(frames) > 1:
+            frames[:] = [pd.concat(frames, ignore_index=True)]
+        return frames[0]
+
+    def read(self, slug_id: str) -> pd.DataFrame:
+        with self._lock:
+            return self._read(slug_id)
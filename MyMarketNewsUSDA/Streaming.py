@@ -0,0 +1,147 @@
+"""
+Author: Jacob Dallas
+
+Incremental decoding of API responses. The rows of the `results` array are decoded one at a time while the body is
+still being downloaded, so a response never has to be held in memory as a whole.
+"""
+import codecs
+import json
+import re
+from typing import Any, Iterable, Iterator, List
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+DEFAULT_BATCH_SIZE = 5000
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_decoder = json.JSONDecoder()
+
+
+class _Buffer:
+    """
+    Text buffer fed from a byte stream, consumed from the front
+    """
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        """
+        Reads the next chunk into the buffer
+        :return: False if the stream is exhausted
+        """
+        if self.eof:
+            return False
+        # drop the consumed text so the buffer stays around one chunk in size
+        if self.pos:
+            self.text = self.text[self.pos:]
+            self.pos = 0
+        for chunk in self._chunks:
+            if not chunk:
+                continue
+            self.text += self._decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+            return True
+        self.text += self._decoder.decode(b"", final=True)
+        self.eof = True
+        return False
+
+    def peek(self) -> str:
+        """
+        Skips whitespace and returns the next character, or "" at the end of the stream
+        """
+        while True:
+            self.pos = _WHITESPACE.match(self.text, self.pos).end()
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, char: str) -> None:
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Malformed JSON response: expected {char!r} but found {found!r} at position {self.pos}")
+        self.pos += 1
+
+    def value(self) -> Any:
+        """
+        Decodes the next JSON value, reading more chunks until it is complete
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            # a number at the very end of the buffer may continue in the next chunk
+            if end == len(self.text) and not self.eof and not isinstance(value, (dict, list, str)):
+                self.fill()
+                continue
+            self.pos = end
+            return value
+
+
+def iter_json_array(chunks: Iterable[bytes], key: str = "results") -> Iterator[Any]:
+    """
+    Yields the elements of the array stored under key in a streamed JSON object, one at a time. If the body is itself
+    an array its elements are yielded directly
+    :param chunks: The body of the response as an iterable of byte chunks
+    :param key: The key of the array inside the top level object
+    :return: An iterator over the elements of the array, empty if the key is missing
+    """
+    buffer = _Buffer(chunks)
+    first = buffer.peek()
+    if first == "[":
+        yield from _iter_array(buffer)
+        return
+    buffer.expect("{")
+    while True:
+        char = buffer.peek()
+        if char == "}" or char == "":
+            return
+        if char == ",":
+            buffer.pos += 1
+            continue
+        name = buffer.value()
+        buffer.expect(":")
+        if name == key and buffer.peek() == "[":
+            yield from _iter_array(buffer)
+            return
+        buffer.value()
+
+
+def _iter_array(buffer: _Buffer) -> Iterator[Any]:
+    buffer.expect("[")
+    while True:
+        char = buffer.peek()
+        if char == "]":
+            buffer.pos += 1
+            return
+        if char == "":
+            raise ValueError("Malformed JSON response: the stream ended inside an array")
+        if char == ",":
+            buffer.pos += 1
+            continue
+        yield buffer.value()
+
+
+def iter_batches(rows: Iterable[Any], batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[List[Any]]:
+    """
+    Groups rows into lists of at most batch_size rows
+    :param rows: The rows to group
+    :param batch_size: The maximum number of rows per batch
+    :return: An iterator over the batches
+    """
+    if batch_size is None or batch_size < 1:
+        raise ValueError(f"batch_size must be at least 1, not {batch_size}")
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
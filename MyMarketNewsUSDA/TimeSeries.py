@@ -0,0 +1,122 @@
+"""
+Author: Jacob Dallas
+
+Turns report data into date indexed time series. The series of every commodity and metric are built with one groupby
+over the whole frame (resampled with a pd.Grouper when a frequency is given) and reshaped with unstack / stack, so
+nothing loops over the rows in Python.
+"""
+from typing import Dict, List, Sequence, Union
+
+import pandas as pd
+
+from MyMarketNewsUSDA.Decoding import is_identifier
+
+LAYOUTS = ("wide", "long")
+
+
+def to_numeric(column: pd.Series, errors: str = "coerce") -> pd.Series:
+    """
+    Parses a column of numbers returned as text, thousands separators included
+    :param column: The column
+    :param errors: "coerce" to turn values that do not parse into NaN, "raise" to raise a ValueError instead
+    :return: The column as float64
+    """
+    if pd.api.types.is_numeric_dtype(column) and not pd.api.types.is_bool_dtype(column):
+        return column.astype("float64")
+    text = column.astype(str).str.replace(",", "", regex=False).str.strip()
+    try:
+        # a plain cast is several times faster than to_numeric when every value parses, which is the common case
+        return text.astype("float64")
+    except (TypeError, ValueError):
+        if errors == "raise":
+            raise ValueError(f"{column.name} holds values that are not numbers")
+        return pd.to_numeric(text, errors="coerce").astype("float64")
+
+
+def _metric_values(frame: pd.DataFrame, exclude: Sequence[str] = ()) -> Dict[str, pd.Series]:
+    skipped = set(exclude)
+    values = {}
+    for name in frame.columns:
+        column = frame[name]
+        # identifiers such as slug_id or office_code hold numbers but are not measurements
+        if name in skipped or is_identifier(name) or pd.api.types.is_bool_dtype(column) \
+                or pd.api.types.is_datetime64_any_dtype(column):
+            continue
+        present = column.notna()
+        if not present.any():
+            continue
+        try:
+            values[name] = to_numeric(column if present.all() else column.where(present, "nan"), errors="raise")
+        except ValueError:
+            continue
+    return values
+
+
+def metric_columns(frame: pd.DataFrame, exclude: Sequence[str] = ()) -> List[str]:
+    """
+    Finds the measurement columns of a report, the columns whose every value is a number
+    :param frame: The report data
+    :param exclude: Columns never treated as measurements, on top of the identifiers, see Decoding.is_identifier
+    :return: The names of the measurement columns
+    """
+    return list(_metric_values(frame, exclude))
+
+
+def time_series(frame: pd.DataFrame, values: Union[str, Sequence[str]] = None, date_column: str = "report_date",
+                by: Union[str, Sequence[str], None] = "commodity", freq: str = None, agg: str = "mean",
+                layout: str = "wide", ffill: bool = False) -> pd.DataFrame:
+    """
+    Builds the time series of a report per commodity (or any other grouping column) and metric
+
+    :param frame: The report data, as returned by get_report_frame or Report.to_frame
+    :param values: The metric column(s), if None every column holding only numbers is used
+    :param date_column: The column the series are indexed by
+    :param by: The column(s) splitting the series, None for a single series per metric
+    :param freq: A pandas offset alias (e.g. "W" or "MS") the series are resampled to, if None the series keep
+        the dates of the report
+    :param agg: How values sharing a date (or a resampling period) are combined, any pandas aggregation name
+    :param layout: "wide" for a frame indexed by date with (metric, commodity) columns, "long" for a frame with the
+        columns date, commodity, metric and value
+    :param ffill: If True missing dates of a wide series are filled with the last known value
+    :return: The time series
+    """
+    if layout not in LAYOUTS:
+        raise ValueError(f"layout must be one of {LAYOUTS}, not {layout}")
+    if date_column not in frame.columns:
+        raise KeyError(f"{date_column} is not a column of the report, columns are: {list(frame.columns)}")
+    by = [] if by is None else [by] if isinstance(by, str) else list(by)
+    missing = [x for x in by if x not in frame.columns]
+    if missing:
+        raise KeyError(f"{missing} are not columns of the report, columns are: {list(frame.columns)}")
+    if values is None:
+        numbers = _metric_values(frame, exclude=[date_column] + by)
+    else:
+        values = [values] if isinstance(values, str) else list(values)
+        missing = [x for x in values if x not in frame.columns]
+        if missing:
+            raise KeyError(f"{missing} are not columns of the report, columns are: {list(frame.columns)}")
+        numbers = {x: to_numeric(frame[x]) for x in values}
+    values = list(numbers)
+
+    dates = frame[date_column]
+    if not pd.api.types.is_datetime64_any_dtype(dates):
+        dates = pd.to_datetime(dates, errors="coerce")
+    data = pd.DataFrame({date_column: dates, **{x: frame[x] for x in by},
+                         **numbers})
+    data = data[data[date_column].notna()]
+
+    date_key = date_column if freq is None else pd.Grouper(key=date_column, freq=freq)
+    grouped = data.groupby([date_key] + by, observed=True, sort=True)[values].agg(agg)
+
+    if layout == "long":
+        return grouped.reset_index().melt(id_vars=[date_column] + by, value_vars=values, var_name="metric",
+                                          value_name="value")
+
+    wide = grouped.unstack(by) if by else grouped
+    if freq is not None and len(wide):
+        # groupby leaves out the periods without any rows, resampled series keep one row per period
+        wide = wide.asfreq(freq)
+    if ffill:
+        wide = wide.ffill()
+    wide.columns = wide.columns.set_names(["metric"] + by) if by else wide.columns.set_names("metric")
+    return wide
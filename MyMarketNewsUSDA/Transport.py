@@ -0,0 +1,390 @@
+"""
+Author: Jacob Dallas
+
+HTTP transports of the MyMarketNews API classes. Every ApiBase subclass routes its requests through a transport:
+HttpTransport pools and keeps alive the TCP/TLS connections to the USDA hosts, FakeTransport answers from memory and
+CassetteTransport records live traffic to a file and replays it, so that clients can run without the live service.
+"""
+import abc
+import base64
+import datetime
+import io
+import json
+import os
+import threading
+import weakref
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from MyMarketNewsUSDA.Cache import canonical_url, request_key
+
+DEFAULT_POOL_CONNECTIONS = 4
+DEFAULT_POOL_MAXSIZE = 16
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 60.0
+CASSETTE_MODES = ("replay", "record", "auto")
+
+
+def build_response(status_code: int = 200, body: Union[bytes, str, dict, list] = b"", headers: dict = None,
+                   _url: str = None, method: str = "GET") -> requests.Response:
+    """
+    Builds a requests.Response without a network round trip, its body can be read whole or streamed
+    :param status_code: The HTTP status
+    :param body: The body, dicts and lists are encoded as JSON
+    :param headers: The response headers
+    :param _url: The URL of the request
+    :param method: The method of the request
+    :return: The response
+    """
+    if isinstance(body, (dict, list)):
+        body = json.dumps(body).encode()
+    elif isinstance(body, str):
+        body = body.encode()
+    response = requests.Response()
+    response.status_code = status_code
+    response.reason = "OK" if status_code < 400 else "Error"
+    response.headers = CaseInsensitiveDict(headers or {})
+    response.headers.setdefault("Content-Length", str(len(body)))
+    response.raw = io.BytesIO(body)
+    response.url = _url
+    response.encoding = "utf-8"
+    response.elapsed = datetime.timedelta(0)
+    response.request = requests.Request(method, _url).prepare() if _url else None
+    return response
+
+
+class Transport(abc.ABC):
+    """
+    Interface of the transports ApiBase sends its requests through. get and post take the keyword arguments of
+    requests (auth, json, stream, timeout) and return a requests.Response
+    """
+    @abc.abstractmethod
+    def get(self, _url: str, timeout=None, **kwargs) -> requests.Response:
+        """
+        Sends a GET request
+        :param _url: The URL to request
+        :param timeout: Overrides the transport timeout for this request
+        :return: The response
+        """
+
+    @abc.abstractmethod
+    def post(self, _url: str, timeout=None, **kwargs) -> requests.Response:
+        """
+        Sends a POST request
+        :param _url: The URL to request
+        :param timeout: Overrides the transport timeout for this request
+        :return: The response
+        """
+
+    def close(self) -> None:
+        """
+        Releases the resources of the transport
+        """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class HttpTransport(Transport):
+    """
+    Pooled, keep-alive HTTP transport backed by requests
+
+    A single HTTPAdapter (and therefore a single urllib3 connection pool) is shared by every thread, while each
+    thread gets its own requests.Session on top of it, since Session objects themselves are not thread safe. Sessions
+    are only weakly referenced by the transport, the session of a thread is released when the thread exits.
+
+    :param pool_connections: The number of distinct hosts to keep connection pools for
+    :param pool_maxsize: The maximum number of connections kept alive per host
+    :param keep_alive: If False, every request asks the server to close the connection afterwards
+    :param timeout: Either a single timeout in seconds or a (connect, read) tuple
+    :param max_retries: The number of low level connection retries the adapter performs
+    """
+    def __init__(self, pool_connections: int = DEFAULT_POOL_CONNECTIONS, pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+                 keep_alive: bool = True,
+                 timeout: Union[float, Tuple[float, float]] = (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT),
+                 max_retries: int = 0):
+        if pool_connections < 1 or pool_maxsize < 1:
+            raise ValueError(f"pool_connections and pool_maxsize must be at least 1, "
+                             f"not {pool_connections} and {pool_maxsize}")
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self._adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                                    max_retries=max_retries)
+        self._local = threading.local()
+        self._sessions = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @property
+    def session(self) -> requests.Session:
+        """
+        The requests.Session belonging to the calling thread, created on first use
+        """
+        session = getattr(self._local, "session", None)
+        if session is None:
+            with self._lock:
+                if self._closed:
+                    raise RuntimeError("This transport has been closed")
+                session = requests.Session()
+                session.mount("https://", self._adapter)
+                session.mount("http://", self._adapter)
+                if not self.keep_alive:
+                    session.headers["Connection"] = "close"
+                self._sessions.add(session)
+            self._local.session = session
+        return session
+
+    def get(self, _url: str, timeout=None, **kwargs) -> requests.Response:
+        """
+        Sends a GET request through the pooled session
+        :param _url: The URL to request
+        :param timeout: Overrides the transport timeout for this request
+        :return: The response
+        """
+        return self.session.get(_url, timeout=self.timeout if timeout is None else timeout, **kwargs)
+
+    def post(self, _url: str, timeout=None, **kwargs) -> requests.Response:
+        """
+        Sends a POST request through the pooled session
+        :param _url: The URL to request
+        :param timeout: Overrides the transport timeout for this request
+        :return: The response
+        """
+        return self.session.post(_url, timeout=self.timeout if timeout is None else timeout, **kwargs)
+
+    def close(self) -> None:
+        """
+        Closes every session and the shared connection pool
+        """
+        with self._lock:
+            self._closed = True
+            for session in list(self._sessions):
+                session.close()
+            self._sessions = weakref.WeakSet()
+            self._adapter.close()
+
+    def __repr__(self):
+        return (f"HttpTransport(pool_connections={self.pool_connections}, pool_maxsize={self.pool_maxsize}, "
+                f"keep_alive={self.keep_alive}, timeout={self.timeout}, sessions={len(self._sessions)})")
+
+
+class FakeTransport(Transport):
+    """
+    In memory transport answering from canned responses, for offline runs and tests
+
+    Responses are matched on the canonical URL (the key parameter is ignored and the query is sorted) and, for POST
+    requests, on the JSON payload. Requests without a canned response are passed to handler, or answered with a 404
+
+    :param handler: Called as handler(method, _url, payload) for unmatched requests, returns a requests.Response
+    """
+    def __init__(self, handler: Callable[[str, str, Any], requests.Response] = None):
+        self.handler = handler
+        self.requests: List[Tuple[str, str, Any]] = []
+        self._responses: Dict[str, Tuple[int, bytes, dict]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, method: str, _url: str, body: Union[bytes, str, dict, list] = b"", payload: dict = None,
+            status_code: int = 200, headers: dict = None) -> None:
+        """
+        Adds a canned response
+        :param method: "GET" or "POST"
+        :param _url: The URL of the request
+        :param body: The response body, dicts and lists are encoded as JSON
+        :param payload: The JSON payload of a POST request
+        :param status_code: The HTTP status
+        :param headers: The response headers
+        :return: None
+        """
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+        elif isinstance(body, str):
+            body = body.encode()
+        with self._lock:
+            self._responses[method.upper() + " " + request_key(_url, payload)] = (status_code, body, headers or {})
+
+    def add_results(self, method: str, _url: str, results: list, payload: dict = None) -> None:
+        """
+        Adds a canned 200 response holding result rows the way the API returns them
+        :param method: "GET" or "POST"
+        :param _url: The URL of the request
+        :param results: The result rows
+        :param payload: The JSON payload of a POST request
+        :return: None
+        """
+        self.add(method, _url, {"results": results}, payload)
+
+    def request(self, method: str, _url: str, payload: Any = None) -> requests.Response:
+        """
+        Answers a request from the canned responses
+        :param method: "GET" or "POST"
+        :param _url: The URL of the request
+        :param payload: The JSON payload of a POST request
+        :return: The response
+        """
+        with self._lock:
+            self.requests.append((method, _url, payload))
+            canned = self._responses.get(method + " " + request_key(_url, payload))
+        if canned is not None:
+            return build_response(canned[0], canned[1], canned[2], _url, method)
+        if self.handler is not None:
+            return self.handler(method, _url, payload)
+        return build_response(404, {"error": f"no canned response for {method} {canonical_url(_url)}"}, None, _url,
+                              method)
+
+    def get(self, _url: str, timeout=None, **kwargs) -> requests.Response:
+        return self.request("GET", _url)
+
+    def post(self, _url: str, timeout=None, **kwargs) -> requests.Response:
+        return self.request("POST", _url, kwargs.get("json"))
+
+    def __repr__(self):
+        return f"FakeTransport(responses={len(self._responses)}, requests={len(self.requests)})"
+
+
+class CassetteTransport(Transport):
+    """
+    Records the traffic of another transport to a cassette file and replays it, so that recorded production traffic
+    can be replayed at full speed for profiling and load tests. The cassette is a JSON lines file with one interaction
+    per line, request headers (and therefore the API key) are never recorded
+
+    :param path: The cassette file
+    :param mode: "replay" answers from the cassette only, "record" sends every request and appends it to the cassette,
+        "auto" replays recorded requests and records the others
+    :param transport: The transport recorded requests are sent through, defaults to a new HttpTransport
+    """
+    def __init__(self, path: str, mode: str = "auto", transport: Transport = None):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"mode must be one of {CASSETTE_MODES}, not {mode}")
+        if mode == "replay" and not os.path.exists(path):
+            raise FileNotFoundError(f"The cassette {path} does not exist")
+        self.path = path
+        self.mode = mode
+        self._transport = transport
+        self.hits = 0
+        self.recorded = 0
+        self._interactions: Dict[str, List[dict]] = {}
+        self._replayed: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        interaction = json.loads(line)
+                        self._interactions.setdefault(interaction["key"], []).append(interaction)
+
+    @property
+    def transport(self) -> Transport:
+        """
+        The transport recorded requests are sent through
+        """
+        if self._transport is None:
+            # not the shared transport, which may be this cassette itself
+            with self._lock:
+                if self._transport is None:
+                    self._transport = HttpTransport()
+        return self._transport
+
+    def __len__(self):
+        return sum(len(x) for x in self._interactions.values())
+
+    def _replay(self, key: str) -> Optional[dict]:
+        with self._lock:
+            interactions = self._interactions.get(key)
+            if not interactions:
+                return None
+            # identical requests are answered in recorded order, the last answer is repeated once they run out
+            position = self._replayed.get(key, 0)
+            self._replayed[key] = position + 1
+            self.hits += 1
+            return interactions[min(position, len(interactions) - 1)]
+
+    def _record(self, key: str, method: str, _url: str, payload: Any, response: requests.Response) -> None:
+        body = response.content
+        try:
+            encoded, encoding = body.decode("utf-8"), "utf-8"
+        except UnicodeDecodeError:
+            encoded, encoding = base64.b64encode(body).decode("ascii"), "base64"
+        interaction = {"key": key, "method": method, "url": canonical_url(_url), "payload": payload,
+                       "status_code": response.status_code,
+                       "headers": {k: v for k, v in response.headers.items()
+                                   if k.lower() not in ("set-cookie", "content-encoding", "transfer-encoding")},
+                       "body": encoded, "encoding": encoding}
+        with self._lock:
+            self._interactions.setdefault(key, []).append(interaction)
+            self.recorded += 1
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(interaction) + "\n")
+
+    def request(self, method: str, _url: str, payload: Any = None, timeout=None, **kwargs) -> requests.Response:
+        """
+        Answers a request from the cassette, or sends and records it
+        :param method: "GET" or "POST"
+        :param _url: The URL of the request
+        :param payload: The JSON payload of a POST request
+        :param timeout: Overrides the timeout of recorded requests
+        :param kwargs: The other keyword arguments of recorded requests, e.g. auth
+        :return: The response
+        """
+        key = method + " " + request_key(_url, payload)
+        interaction = None if self.mode == "record" else self._replay(key)
+        if interaction is not None:
+            body = interaction["body"]
+            body = base64.b64decode(body) if interaction.get("encoding") == "base64" else body.encode("utf-8")
+            return build_response(interaction["status_code"], body, interaction["headers"], _url, method)
+        if self.mode == "replay":
+            raise LookupError(f"The cassette {self.path} has no recorded response for {method} {canonical_url(_url)}")
+        kwargs.pop("stream", None)
+        if method == "GET":
+            response = self.transport.get(_url, timeout=timeout, **kwargs)
+        else:
+            response = self.transport.post(_url, timeout=timeout, json=payload, **kwargs)
+        self._record(key, method, _url, payload, response)
+        return response
+
+    def get(self, _url: str, timeout=None, **kwargs) -> requests.Response:
+        return self.request("GET", _url, None, timeout, **kwargs)
+
+    def post(self, _url: str, timeout=None, **kwargs) -> requests.Response:
+        return self.request("POST", _url, kwargs.pop("json", None), timeout, **kwargs)
+
+    def __repr__(self):
+        return f"CassetteTransport(path={self.path!r}, mode={self.mode!r}, interactions={len(self)})"
+
+
+_default_transport: Optional[Transport] = None
+_default_transport_lock = threading.Lock()
+
+
+def get_default_transport() -> Transport:
+    """
+    Returns the process wide transport used by every ApiBase instance that was not given its own
+    :return: The shared transport, an HttpTransport unless it was replaced
+    """
+    global _default_transport
+    if _default_transport is None:
+        with _default_transport_lock:
+            if _default_transport is None:
+                _default_transport = HttpTransport()
+    return _default_transport
+
+
+def set_default_transport(transport: Optional[Transport]) -> None:
+    """
+    Replaces the process wide transport, e.g. to change pool sizes or timeouts for every client at once, or to run
+    every client against a FakeTransport or CassetteTransport
+    :param transport: The transport to use, or None to fall back to a freshly created default on next use
+    :return: None
+    """
+    global _default_transport
+    with _default_transport_lock:
+        _default_transport = transport
@@ -0,0 +1,218 @@
+"""
+Author: Jacob Dallas
+
+Local Parquet warehouse for report and market data. Reports are partitioned by slug_id and year, markets by commodity
+and year, using hive style directories:
+
+    <root>/reports/slug_id=<slug_id>/year=<year>/part-<uuid>.parquet
+    <root>/markets/commodity=<commodity>/year=<year>/part-<uuid>.parquet
+
+Reads only open the partitions they ask for and push any further filter down to the Parquet row groups.
+
+Requires pyarrow (`pip install pyarrow`).
+"""
+import datetime
+import os
+import threading
+import uuid
+from typing import Iterable, List, Optional, Union
+from urllib.parse import quote
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError as e:
+    raise ImportError("The Parquet warehouse requires pyarrow, install it with `pip install pyarrow`") from e
+
+import pandas as pd
+
+from MyMarketNewsUSDA.Store import ReportStore, latest_row_date
+
+REPORTS_DIRECTORY = "reports"
+MARKETS_DIRECTORY = "markets"
+UNKNOWN_YEAR = 0
+
+
+def _partition_directory(name: str, value) -> str:
+    # matches the "uri" segment encoding pyarrow uses to decode hive partitions
+    return f"{name}={quote(str(value), safe='')}"
+
+
+def _normalize(frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    Gives every column a type that stays stable between appends: text and empty columns become strings and integers
+    become floats, so that files written from different batches can be read as one dataset
+    """
+    frame = frame.copy()
+    for column in frame.columns:
+        dtype = frame[column].dtype
+        if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_datetime64_any_dtype(dtype):
+            continue
+        if pd.api.types.is_integer_dtype(dtype):
+            frame[column] = frame[column].astype("float64")
+        elif not pd.api.types.is_float_dtype(dtype):
+            frame[column] = frame[column].map(
+                lambda x: None if x is None or x is pd.NA or x != x else str(x)).astype("string")
+    return frame
+
+
+class ParquetWarehouse(ReportStore):
+    """
+    Parquet store of report and market data, also usable as the store of Report.sync
+
+    :param root: The directory of the warehouse
+    :param date_column: The column used to derive the year partition of report rows
+    :param market_date_column: The column used to derive the year partition of market rows, if it is missing the
+        year of the market begin_date is used
+    :param market_commodity_column: The column of the market rows holding their commodity
+    """
+    def __init__(self, root: str, date_column: str = "report_date", market_date_column: str = "report_date",
+                 market_commodity_column: str = "commodity"):
+        self.root = root
+        self.date_column = date_column
+        self.market_date_column = market_date_column
+        self.market_commodity_column = market_commodity_column
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _years(self, frame: pd.DataFrame, column: str, fallback: Optional[int] = None) -> pd.Series:
+        if column in frame.columns:
+            dates = pd.to_datetime(frame[column], format="%m/%d/%Y", errors="coerce")
+            if dates.isna().all():
+                dates = pd.to_datetime(frame[column], errors="coerce")
+            years = dates.dt.year
+        else:
+            years = pd.Series(float("nan"), index=frame.index)
+        return years.fillna(UNKNOWN_YEAR if fallback is None else fallback).astype(int)
+
+    def _write(self, directory: str, key_name: str, keys: pd.Series, frame: pd.DataFrame, years: pd.Series) -> int:
+        frame = _normalize(frame.drop(columns=[x for x in (key_name, "year") if x in frame.columns]))
+        for (key, year), positions in frame.groupby([keys.to_numpy(), years.to_numpy()]).indices.items():
+            path = os.path.join(self.root, directory, _partition_directory(key_name, key),
+                                _partition_directory("year", year))
+            os.makedirs(path, exist_ok=True)
+            table = pa.Table.from_pandas(frame.iloc[positions], preserve_index=False)
+            pq.write_table(table, os.path.join(path, f"part-{uuid.uuid4().hex}.parquet"))
+        return len(frame)
+
+    def _files(self, directory: str, key_name: str, keys: Iterable, years: Iterable[int] = None) -> List[str]:
+        files = []
+        for key in keys:
+            key_path = os.path.join(self.root, directory, _partition_directory(key_name, key))
+            if not os.path.isdir(key_path):
+                continue
+            year_directories = sorted(os.listdir(key_path)) if years is None else \
+                [_partition_directory("year", x) for x in years]
+            for year_directory in year_directories:
+                path = os.path.join(key_path, year_directory)
+                if os.path.isdir(path):
+                    files.extend(os.path.join(path, x) for x in sorted(os.listdir(path)) if x.endswith(".parquet"))
+        return files
+
+    def _read(self, directory: str, key_name: str, keys: Iterable, years: Iterable[int] = None,
+              columns: List[str] = None, filter: ds.Expression = None) -> pd.DataFrame:
+        files = self._files(directory, key_name, keys, years)
+        if not files:
+            return pd.DataFrame(columns=columns)
+        partitioning = ds.partitioning(pa.schema([(key_name, pa.string()), ("year", pa.int32())]), flavor="hive")
+        dataset = ds.dataset(files, format="parquet", partitioning=partitioning,
+                             partition_base_dir=os.path.join(self.root, directory))
+        # the dataset takes its schema from the first file, columns that only appear in later batches (or whose
+        # values were all missing in the first one) would be dropped or fail to resolve
+        schema = pa.unify_schemas([dataset.schema] + [pq.read_schema(x) for x in files], promote_options="permissive")
+        return dataset.replace_schema(schema).to_table(columns=columns, filter=filter).to_pandas()
+
+    def write_rows(self, slug_id: str, rows: Union[list, pd.DataFrame]) -> int:
+        """
+        Writes result rows of a report
+        :param slug_id: The ID of the report
+        :param rows: The result rows as a list of dicts or a dataframe
+        :return: The number of written rows
+        """
+        frame = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(rows)
+        if frame.empty:
+            return 0
+        with self._lock:
+            return self._write(REPORTS_DIRECTORY, "slug_id", pd.Series(str(slug_id), index=frame.index), frame,
+                               self._years(frame, self.date_column))
+
+    def write_report(self, report) -> int:
+        """
+        Writes the data of a Report
+        :param report: The Report whose data is written
+        :return: The number of written rows
+        """
+        return self.write_rows(report.slug_id, report.data or [])
+
+    def write_market(self, market) -> int:
+        """
+        Writes the data of a Market, partitioned by the upper cased commodity of every row (or the commodity of the
+        market if its rows have no commodity column)
+        :param market: The Market whose data is written
+        :return: The number of written rows
+        """
+        frame = market.data if isinstance(market.data, pd.DataFrame) else pd.DataFrame(market.data)
+        if frame.empty:
+            return 0
+        if self.market_commodity_column in frame.columns:
+            keys = frame[self.market_commodity_column].astype(str).str.upper()
+            frame = frame.drop(columns=[self.market_commodity_column])
+        else:
+            keys = pd.Series(str(market.commodity).upper(), index=frame.index)
+        fallback = None
+        if market.begin_date is not None:
+            fallback = datetime.datetime.strptime(market.begin_date, "%m/%d/%Y").year
+        with self._lock:
+            return self._write(MARKETS_DIRECTORY, "commodity", keys, frame,
+                               self._years(frame, self.market_date_column, fallback))
+
+    def read(self, slug_id: str, years: Iterable[int] = None, columns: List[str] = None,
+             filter: ds.Expression = None) -> pd.DataFrame:
+        """
+        Reads the stored rows of a report, only the requested partitions are opened
+        :param slug_id: The ID of the report
+        :param years: Restricts the read to these year partitions
+        :param columns: Restricts the read to these columns
+        :param filter: A pyarrow.dataset expression pushed down to the Parquet row groups,
+            e.g. pyarrow.dataset.field("commodity") == "Butter"
+        :return: The stored rows
+        """
+        return self._read(REPORTS_DIRECTORY, "slug_id", [slug_id], years, columns, filter)
+
+    def read_market(self, commodity: str, years: Iterable[int] = None, columns: List[str] = None,
+                    filter: ds.Expression = None) -> pd.DataFrame:
+        """
+        Reads the stored market rows of a commodity, only the requested partitions are opened
+        :param commodity: The upper cased commodity (e.g. "APPLES")
+        :param years: Restricts the read to these year partitions
+        :param columns: Restricts the read to these columns
+        :param filter: A pyarrow.dataset expression pushed down to the Parquet row groups
+        :return: The stored rows
+        """
+        return self._read(MARKETS_DIRECTORY, "commodity", [str(commodity).upper()], years, columns, filter)
+
+    def latest_date(self, slug_id: str, column: str = "report_date") -> Optional[datetime.date]:
+        """
+        Reads the newest date of a column for a report, starting with the newest year partition
+        """
+        key_path = os.path.join(self.root, REPORTS_DIRECTORY, _partition_directory("slug_id", slug_id))
+        if not os.path.isdir(key_path):
+            return None
+        years = sorted((int(x.split("=", 1)[1]) for x in os.listdir(key_path) if x.startswith("year=")), reverse=True)
+        for year in years:
+            try:
+                frame = self.read(slug_id, years=[year], columns=[column])
+            except pa.ArrowInvalid:
+                # the column does not exist in this partition
+                continue
+            latest = latest_row_date(frame, column)
+            if latest is not None:
+                return latest
+        return None
+
+    def append(self, slug_id: str, rows: list) -> int:
+        return self.write_rows(slug_id, rows)
+
+    def __repr__(self):
+        return f"ParquetWarehouse(root={self.root!r})"
@@ -596,3 +596,23 @@ ORNAMENTALS_COMMODITIES = [x for x in set([x["name"] for x in COMMODITY_DATA if
 HEMP_COMMODITIES = [x for x in set([x["name"] for x in COMMODITY_DATA if x["class"] == "HEMP"])]
 COMPOSITE_COMMODITIES = [x for x in set(FRUIT_COMMODITIES + ONIONS_AND_POTATOES_COMMODITIES + VEGETABLES_COMMODITIES +
                                         HERBS_COMMODITIES + ORNAMENTALS_COMMODITIES + HEMP_COMMODITIES)]
+
+# precomputed lookups, built once at import so validation never scans the lists above
+COMMODITY_INDEX = {}
+for _commodity_data in COMMODITY_DATA:
+    _entry = COMMODITY_INDEX.setdefault(_commodity_data["commodity"], {"class": _commodity_data["class"],
+                                                                       "classes": set(), "regions": set()})
+    _entry["classes"].add(_commodity_data["class"])
+    _entry["regions"].update(_commodity_data["regions"])
+for _entry in COMMODITY_INDEX.values():
+    _entry["classes"] = frozenset(_entry["classes"])
+    _entry["regions"] = frozenset(_entry["regions"])
+del _commodity_data, _entry
+COMMODITY_CLASS_INDEX = {x: frozenset(y["commodity"] for y in COMMODITY_DATA if y["class"] == x)
+                         for x in COMMODITY_CLASSES if x != "ALL"}
+COMMODITY_SET = frozenset(COMPOSITE_COMMODITIES)
+COMMODITY_CLASS_SET = frozenset(COMMODITY_CLASSES)
+COMMODITY_REGION_SET = frozenset(COMMODITY_REGIONS)
+SORTED_COMMODITIES = tuple(sorted(COMMODITY_INDEX))
+SORTED_COMMODITY_CLASSES = tuple(sorted(COMMODITY_CLASSES))
+SORTED_COMMODITY_REGIONS = tuple(sorted(COMMODITY_REGIONS))
@@ -0,0 +1,247 @@
+"""
+Author: Jacob Dallas
+
+Offline benchmark of the client against the local stand-in of both endpoints (benchmarks/stub_server.py, started in
+its own process so that it does not compete with the client for the GIL). For every scenario it measures the
+operations per second, the p50 and p99 latency and the peak Python memory of one operation.
+
+    python benchmarks/client_bench.py --iterations 200 --report-size 5000 --output results/base.json
+    python benchmarks/client_bench.py --compare results/base.json --tolerance 0.2
+
+With --compare, the run exits with status 1 if a metric regressed by more than the tolerance against the baseline.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from MyMarketNewsUSDA.ApiBase import ApiBase  # noqa: E402
+from MyMarketNewsUSDA.Catalog import CatalogCache  # noqa: E402
+from MyMarketNewsUSDA.Market import Market  # noqa: E402
+from MyMarketNewsUSDA.MyMarketNews import MyMarketNews  # noqa: E402
+from MyMarketNewsUSDA.RateLimit import RateLimiter, RetryPolicy  # noqa: E402
+from MyMarketNewsUSDA.Report import Report  # noqa: E402
+
+API_KEY = "benchmark"
+SCENARIOS = ("get_data", "report_load", "report_frame", "report_frame_stream", "market_refresh", "current_reports",
+             "catalog_poll")
+# higher is better for requests_per_second, lower is better for everything else
+METRICS = ("requests_per_second", "p50_ms", "p99_ms", "peak_memory_bytes")
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    :param values: The measured values
+    :param q: The percentile, between 0 and 100
+    :return: the percentile of the values, interpolated between the closest ranks
+    """
+    values = sorted(values)
+    if len(values) == 1:
+        return values[0]
+    rank = (len(values) - 1) * q / 100
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def client_kwargs() -> dict:
+    """
+    Every benchmarked client bypasses the client side rate limit and retries without waiting, so that the numbers
+    show the cost of the client and not of its politeness towards the real servers
+    """
+    return {"rate_limiter": RateLimiter(rate=1e9, burst=10 ** 9),
+            "retry_policy": RetryPolicy(max_retries=5, backoff_base=0.001, backoff_max=0.01)}
+
+
+def scenarios() -> Dict[str, Callable[[], object]]:
+    """
+    :return: the benchmarked operations, each sends one request to the stub server when it does not fail
+    """
+    base = ApiBase(API_KEY, **client_kwargs())
+    # identical concurrent requests would otherwise be coalesced and counted as one
+    base.single_flight = None
+    _url = base.create_api_url(slug_id="2451")
+
+    def get_data():
+        return base.get_data(_url)
+
+    def report_load():
+        report = Report(api_key=API_KEY, slug_id="2451", **client_kwargs())
+        report.single_flight = None
+        return report.load()
+
+    def report_frame():
+        return base.get_report_frame("2451")
+
+    def report_frame_stream():
+        return base.get_report_frame("2451", stream=True)
+
+    def market_refresh():
+        market = Market(commodity="APPLES", region="National", class_="All", organic="No", begin_date="01/01/2024",
+                        end_date="01/31/2024", **client_kwargs())
+        market.single_flight = None
+        market.refresh_data()
+        return market.data
+
+    def current_reports():
+        mmn = MyMarketNews(API_KEY, catalog=CatalogCache(), **client_kwargs())
+        mmn.single_flight = None
+        return mmn.get_current_reports(force=True)
+
+    # the catalog is revalidated on every call, an unchanged catalog is answered with a 304 and not parsed again
+    poller = MyMarketNews(API_KEY, catalog=CatalogCache(ttl=0), **client_kwargs())
+    poller.single_flight = None
+
+    def catalog_poll():
+        return poller.get_current_reports()
+
+    return {"get_data": get_data, "report_load": report_load, "report_frame": report_frame,
+            "report_frame_stream": report_frame_stream, "market_refresh": market_refresh,
+            "current_reports": current_reports, "catalog_poll": catalog_poll}
+
+
+def measure(operation: Callable[[], object], iterations: int, concurrency: int, warmup: int = 3) -> dict:
+    """
+    Runs an operation repeatedly
+    :param operation: The operation
+    :param iterations: The number of timed runs
+    :param concurrency: The number of threads running the operation at once
+    :param warmup: The number of untimed runs first
+    :return: the throughput, latency percentiles, peak memory and number of failed runs
+    """
+    for _ in range(warmup):
+        operation()
+
+    errors = 0
+
+    def timed(_):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            operation()
+        except Exception:
+            errors += 1
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    if concurrency == 1:
+        latencies = [timed(x) for x in range(iterations)]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            latencies = list(executor.map(timed, range(iterations)))
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    try:
+        operation()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"iterations": iterations, "concurrency": concurrency, "errors": errors,
+            "requests_per_second": iterations / elapsed, "p50_ms": percentile(latencies, 50) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000, "peak_memory_bytes": peak}
+
+
+def start_server(args: argparse.Namespace) -> Tuple[subprocess.Popen, str]:
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "benchmarks", "stub_server.py"), "--report-size", str(args.report_size),
+         "--market-size", str(args.market_size), "--catalog-size", str(args.catalog_size), "--latency",
+         str(args.latency), "--error-rate", str(args.error_rate), "--seed", str(args.seed)],
+        stdout=subprocess.PIPE, text=True)
+    return process, process.stdout.readline().strip()
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """
+    :param results: The results of this run
+    :param baseline: The results of an earlier run
+    :param tolerance: The relative change of a metric tolerated before it counts as a regression
+    :return: a description of every regressed metric
+    """
+    if results["config"] != baseline.get("config"):
+        print(f"warning: the baseline was measured with another config: {baseline.get('config')}")
+    regressions = []
+    for name, scenario in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if previous is None:
+            continue
+        for metric in METRICS:
+            if not previous.get(metric):
+                continue
+            change = scenario[metric] / previous[metric] - 1
+            regressed = change < -tolerance if metric == "requests_per_second" else change > tolerance
+            print(f"{name:16} {metric:20} {previous[metric]:14.2f} -> {scenario[metric]:14.2f} ({change:+.1%})"
+                  + ("  REGRESSION" if regressed else ""))
+            if regressed:
+                regressions.append(f"{name} {metric} {change:+.1%}")
+    return regressions
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks the client against a local stand-in of the API")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="defaults to every scenario")
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--report-size", type=int, default=1000, help="rows of every report response")
+    parser.add_argument("--market-size", type=int, default=1000, help="rows of every market response")
+    parser.add_argument("--catalog-size", type=int, default=2000, help="reports in the catalog")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of responses that fail with a 500")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="stores the results as JSON at this path")
+    parser.add_argument("--compare", help="compares the results to the JSON results of an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    process, url = start_server(args)
+    try:
+        ApiBase.report_base_url = url + "/services/v1.2/reports/"
+        ApiBase.market_base_url = url + "/get_external_api/result"
+        operations = scenarios()
+        results = {"revision": git_revision(), "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+                   "python": platform.python_version(), "platform": platform.platform(),
+                   "config": {x: getattr(args, x) for x in ("iterations", "concurrency", "report_size", "market_size",
+                                                            "catalog_size", "latency", "error_rate", "seed")},
+                   "scenarios": {}}
+        for name in args.scenario or SCENARIOS:
+            result = results["scenarios"][name] = measure(operations[name], args.iterations, args.concurrency)
+            print(f"{name:16} {result['requests_per_second']:9.1f} req/s  p50 {result['p50_ms']:8.2f} ms  "
+                  f"p99 {result['p99_ms']:8.2f} ms  peak {result['peak_memory_bytes'] / 2 ** 20:8.2f} MiB  "
+                  f"errors {result['errors']}")
+    finally:
+        process.terminate()
+        process.wait()
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
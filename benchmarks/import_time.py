@@ -0,0 +1,71 @@
+"""
+Author: Jacob Dallas
+
+Measures the cold import time of the package modules in fresh interpreters and checks that the heavy dependencies
+(pandas, numpy, requests, the commodity tables) are not imported until they are used.
+
+    python benchmarks/import_time.py --budget-ms 100
+
+Exits with status 1 if the median import time of a module is over the budget or a heavy dependency was imported.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ("MyMarketNewsUSDA.Market", "MyMarketNewsUSDA.Report", "MyMarketNewsUSDA.MyMarketNews")
+HEAVY_MODULES = ("pandas", "numpy", "requests", "assets.commodities", "sqlite3", "asyncio", "concurrent.futures")
+DEFAULT_BUDGET_MS = 100.0
+DEFAULT_REPEAT = 7
+
+_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"ms": elapsed * 1000, "heavy": [x for x in {heavy!r} if x in sys.modules]}}))
+"""
+
+
+def measure(module: str, repeat: int = DEFAULT_REPEAT) -> dict:
+    """
+    Imports a module in fresh interpreters
+    :param module: The module to import
+    :param repeat: The number of interpreters started
+    :return: the median and minimum import time in milliseconds and the heavy modules imported along
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT] + [x for x in [os.environ.get("PYTHONPATH")] if x]))
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", _SCRIPT.format(module=module, heavy=HEAVY_MODULES)],
+                                env=env, cwd=ROOT, capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    times = [x["ms"] for x in runs]
+    return {"module": module, "median_ms": statistics.median(times), "min_ms": min(times),
+            "heavy": sorted({y for x in runs for y in x["heavy"]})}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Checks the cold import time of the package")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    results = [measure(x, args.repeat) for x in MODULES]
+    failed = [x for x in results if x["median_ms"] > args.budget_ms or x["heavy"]]
+    if args.json:
+        print(json.dumps({"budget_ms": args.budget_ms, "results": results}, indent=2))
+    else:
+        for x in results:
+            status = "FAIL" if x in failed else "ok"
+            print(f"{status:4} {x['module']:32} median {x['median_ms']:7.1f} ms  min {x['min_ms']:7.1f} ms"
+                  + (f"  imported {', '.join(x['heavy'])}" if x["heavy"] else ""))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,240 @@
+"""
+Author: Jacob Dallas
+
+Local stand-in for both MyMarketNews endpoints, used by the benchmarks so that they run offline and measure the
+client rather than the USDA servers. The responses are generated once up front, the server only adds the configured
+latency and errors.
+
+    GET  <report_base_url>           the report catalog, with an ETag and Last-Modified honored by conditional requests
+    GET  <report_base_url><slug_id>  the rows of a report
+    POST <market_base_url>           the rows of a market query
+"""
+import datetime
+import email.utils
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+from urllib.parse import urlsplit
+
+REPORT_PATH = "/services/v1.2/reports/"
+MARKET_PATH = "/get_external_api/result"
+COMMODITIES = ("Butter", "Cheese", "Apples", "Pears", "Lettuce, Green Leaf", "Onions Dry", "Potatoes", "Lemons")
+OFFICES = ("Madison, WI", "Fresno, CA", "Yakima, WA", "Philadelphia, PA")
+
+
+def _dates(count: int, start: datetime.date = datetime.date(2015, 1, 1)) -> List[str]:
+    return [(start + datetime.timedelta(days=x)).strftime("%m/%d/%Y") for x in range(count)]
+
+
+def report_rows(count: int, slug_id: str = "2451") -> List[dict]:
+    """
+    :param count: The number of rows
+    :param slug_id: The ID of the report
+    :return: synthetic report rows, spread over consecutive dates and the stub commodities
+    """
+    dates = _dates(count // len(COMMODITIES) + 1)
+    return [{"report_date": dates[x // len(COMMODITIES)], "published_date": f"{dates[x // len(COMMODITIES)]} 10:00:00",
+             "slug_id": slug_id, "office_name": OFFICES[x % len(OFFICES)],
+             "commodity": COMMODITIES[x % len(COMMODITIES)],
+             "holdings_current_lbs": f"{1000 + x * 7:,}", "holdings_1stDayMTH_lbs": f"{900 + x * 5:,}",
+             "holdings_last_year_lbs": f"{1100 + x * 3:,}", "region": "National"}
+            for x in range(count)]
+
+
+def market_rows(count: int) -> List[dict]:
+    """
+    :param count: The number of rows
+    :return: synthetic market rows, spread over consecutive dates and the stub commodities
+    """
+    dates = _dates(count // len(COMMODITIES) + 1)
+    return [{"report_date": dates[x // len(COMMODITIES)], "commodity": COMMODITIES[x % len(COMMODITIES)],
+             "region": "National", "class": "Fruit", "organic": "No", "low_price": f"{10 + x % 13}.50",
+             "high_price": f"{12 + x % 17}.25", "unit": "40 lb cartons", "market_location_name": OFFICES[x % 4]}
+            for x in range(count)]
+
+
+def catalog_rows(count: int) -> List[dict]:
+    """
+    :param count: The number of reports listed
+    :return: a synthetic report catalog
+    """
+    dates = _dates(count)
+    return [{"slug_id": str(1000 + x), "slug_name": f"AMS_{1000 + x}", "report_title": f"Report {1000 + x}",
+             "published_date": dates[x] + " 10:00:00", "report_date": dates[x], "markets": "National",
+             "market_types": "Point of Sale", "office_name": OFFICES[x % len(OFFICES)],
+             "office_code": f"O{x % len(OFFICES)}", "offices": OFFICES[x % len(OFFICES)]}
+            for x in range(count)]
+
+
+class StubServer:
+    """
+    Threaded HTTP server answering like both MyMarketNews endpoints
+
+    :param report_size: The number of rows of every report response
+    :param market_size: The number of rows of every market response
+    :param catalog_size: The number of reports in the catalog
+    :param latency: Seconds every response is delayed by
+    :param error_rate: The fraction of requests answered with error_status instead
+    :param error_status: The HTTP status of the injected errors
+    :param seed: Seeds the choice of the failing requests
+    :param validators: If False the catalog is sent without ETag and Last-Modified
+    """
+    def __init__(self, report_size: int = 1000, market_size: int = 1000, catalog_size: int = 2000,
+                 latency: float = 0.0, error_rate: float = 0.0, error_status: int = 500, seed: int = 0,
+                 validators: bool = True):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._report_body = json.dumps({"results": report_rows(report_size)}).encode()
+        self._market_body = json.dumps({"results": market_rows(market_size)}).encode()
+        self._catalog_body = json.dumps({"results": catalog_rows(catalog_size)}).encode()
+        self._catalog_headers = {}
+        if validators:
+            self._catalog_headers = {"ETag": '"' + hashlib.sha1(self._catalog_body).hexdigest() + '"',
+                                     "Last-Modified": email.utils.formatdate(time.time(), usegmt=True)}
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """
+        The root URL of the running server
+        """
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def report_base_url(self) -> str:
+        """
+        The URL to use as ApiBase.report_base_url
+        """
+        return self.url + REPORT_PATH
+
+    @property
+    def market_base_url(self) -> str:
+        """
+        The URL to use as ApiBase.market_base_url
+        """
+        return self.url + MARKET_PATH
+
+    def body_size(self, endpoint: str) -> int:
+        """
+        :param endpoint: One of "report", "market" or "catalog"
+        :return: the size in bytes of the responses of the endpoint
+        """
+        return len(getattr(self, f"_{endpoint}_body"))
+
+    def _respond(self, handler: BaseHTTPRequestHandler, body: bytes, headers: dict = None) -> None:
+        with self._lock:
+            self.requests += 1
+            failed = self.error_rate > 0 and self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        if self.latency:
+            time.sleep(self.latency)
+        headers = headers or {}
+        if failed:
+            body, status, headers = b'{"error": "injected"}', self.error_status, {}
+        elif "ETag" in headers and handler.headers.get("If-None-Match") == headers["ETag"] or \
+                "Last-Modified" in headers and handler.headers.get("If-Modified-Since") == headers["Last-Modified"]:
+            body, status = b"", 304
+        else:
+            status = 200
+        handler.send_response(status)
+        for name, value in headers.items():
+            handler.send_header(name, value)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                path = urlsplit(self.path).path
+                if path == REPORT_PATH:
+                    server._respond(self, server._catalog_body, server._catalog_headers)
+                elif path.startswith(REPORT_PATH):
+                    server._respond(self, server._report_body)
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if urlsplit(self.path).path == MARKET_PATH:
+                    server._respond(self, server._market_body)
+                else:
+                    self.send_error(404)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> "StubServer":
+        """
+        Starts serving on a free local port in a background thread
+        :return: The server
+        """
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stops the server
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def __repr__(self):
+        return f"StubServer(latency={self.latency}, error_rate={self.error_rate})"
+
+
+def main() -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serves a local stand-in for the MyMarketNews endpoints")
+    parser.add_argument("--report-size", type=int, default=1000)
+    parser.add_argument("--market-size", type=int, default=1000)
+    parser.add_argument("--catalog-size", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-validators", action="store_true", help="send the catalog without ETag and Last-Modified")
+    args = parser.parse_args()
+    server = StubServer(args.report_size, args.market_size, args.catalog_size, args.latency, args.error_rate,
+                        args.error_status, args.seed, not args.no_validators).start()
+    # the benchmark runner reads the URL from the first line
+    print(server.url, flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
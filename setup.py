@@ -5,5 +5,6 @@ setuptools.setup(name="MyMarketNewsUSDAPy",
                  author="Jacob Dallas",
                  author_email="j.dallas@xspaceapp.com",
                  description="MyMarketNews USDA API Wrapper ",
-                 url="https://github.com/mexicantexan/MyMarketNewsUSDA.git"
+                 url="https://github.com/mexicantexan/MyMarketNewsUSDA.git",
+                 extras_require={"async": ["aiohttp"], "parquet": ["pyarrow"]}
                  )